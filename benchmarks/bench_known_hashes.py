@@ -0,0 +1,65 @@
+#!/usr/bin/python3
+
+# memory and lookup time of knownhashes.KnownHashes against a set of hex strings
+#
+# usage: python benchmarks/bench_known_hashes.py [-n COUNT] [-s ALGORITHM]
+
+import argparse
+import hashlib
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "timestampblocks_pw3d"))
+import knownhashes
+
+def digests(count, hashing):
+    for i in range(count):
+        yield hashlib.new(hashing, str(i).encode("utf-8")).hexdigest()
+
+def measure(build, count, hashing):
+    # tracemalloc slows down allocations, so build time is taken separately
+    start = time.perf_counter()
+    store = build(digests(count, hashing))
+    build_time = time.perf_counter() - start
+    del store
+    tracemalloc.start()
+    store = build(digests(count, hashing))
+    current = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    probes = list(digests(min(count, 100000), hashing)) + list(digests(count + min(count, 100000), hashing))[count:]
+    start = time.perf_counter()
+    found = sum(1 for probe in probes if probe in store)
+    lookup_time = time.perf_counter() - start
+    return {
+        "bytes": current,
+        "bytes_per_digest": current / count,
+        "build_s": build_time,
+        "lookups_per_s": len(probes) / lookup_time,
+        "found": found,
+    }
+
+def build_known(values, hashing):
+    store = knownhashes.KnownHashes(hashing)
+    store.update(values)
+    store.compact()
+    return store
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--count', type=int, default=1000000)
+    parser.add_argument('-s', '--hashing', default="sha384")
+    args = parser.parse_args()
+    results = {
+        "set": measure(set, args.count, args.hashing),
+        "KnownHashes": measure(lambda values: build_known(values, args.hashing), args.count, args.hashing),
+    }
+    print("digests:", args.count, "hashing:", args.hashing)
+    for name in results:
+        r = results[name]
+        print("%-12s %12d bytes %8.1f bytes/digest  build %6.2fs  %10.0f lookups/s  found %d" % (
+            name, r["bytes"], r["bytes_per_digest"], r["build_s"], r["lookups_per_s"], r["found"]))
+
+if __name__ == "__main__":
+    main()
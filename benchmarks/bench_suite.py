@@ -0,0 +1,295 @@
+#!/usr/bin/python3
+
+# timings of the hot paths on synthetic data, to notice regressions
+#
+# Synthetic trees (in a temporary directory unless --workdir is given):
+# | tiny: many small files spread over a few hundred directories
+# | huge: a few large files (long readinto loops of hashengine)
+# | deep: long chains of nested directories
+# | ignored: many patterns in nested .gitignore files, half of the files ignored
+# and a synthetic timestampblocks.log with thousands of v2 blocks in
+# alternating `#hashing` sections (plus #publish lines in between).
+#
+# Timed separately: capture.get_new_hashes (without and with a warm digest
+# cache), HashBlock.scan, capture.evaluate_previous_logs (full replay and
+# from the checkpoint) and capture.build_block. Every result holds the best
+# of --repeat runs, a throughput and the peak of traced Python memory (from
+# an extra run under tracemalloc, skip with --no-memory).
+#
+# usage: python benchmarks/bench_suite.py [--scale F] [-o results.json]
+#        python benchmarks/bench_suite.py --baseline results.json [--threshold 0.1]
+# With --baseline the results are compared by time, the exit code is 1 if
+# anything got slower than the threshold allows.
+
+import argparse
+import configparser
+import contextlib
+import hashlib
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "timestampblocks_pw3d"))
+
+_tree_kinds = ("tiny", "huge", "deep", "ignored")
+_old_mtime = 1000000000 #files are dated back, otherwise the digest cache would not trust them yet
+_log_hashings = ("sha384", "sha256")
+
+@contextlib.contextmanager
+def in_directory(path):
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+def write_file(path, size, seed):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    chunk = hashlib.sha512(str(seed).encode("utf-8")).digest() * 16384 #1 MiB pattern, unique per seed
+    with open(path, "wb") as f:
+        while size > 0:
+            f.write(chunk[:size])
+            size -= len(chunk)
+    os.utime(path, (_old_mtime, _old_mtime))
+
+def make_tree(root, kind, scale):
+    if kind == "tiny":
+        for i in range(int(20000 * scale)):
+            write_file(os.path.join(root, "d%03d" % (i % 200), "f%06d.txt" % i), i % 1024, i)
+    elif kind == "huge":
+        for i in range(4):
+            write_file(os.path.join(root, "blob%d.bin" % i), int(80 * 1024 * 1024 * scale), i)
+    elif kind == "deep":
+        for chain in range(20):
+            path = os.path.join(root, "chain%02d" % chain)
+            for level in range(int(30 * max(scale, 0.1))):
+                path = os.path.join(path, "level%02d" % level)
+                for i in range(5):
+                    write_file(os.path.join(path, "f%d" % i), 512, (chain, level, i))
+    elif kind == "ignored":
+        patterns = ["*.tmp%d" % i for i in range(400)] + ["build%d/" % i for i in range(100)] + ["*.o", "!keep.o"]
+        with open(os.path.join(root, ".gitignore"), "w") as f:
+            f.write("\n".join(patterns) + "\n")
+        for d in range(200):
+            directory = os.path.join(root, "pkg%03d" % d)
+            os.makedirs(directory, exist_ok=True)
+            with open(os.path.join(directory, ".gitignore"), "w") as f:
+                f.write("\n".join(["local%d-*" % i for i in range(20)] + ["!local0-keep"]) + "\n")
+            for i in range(int(50 * scale)):
+                name = ("mod%d.o" if i % 2 else "mod%d.py") % i
+                write_file(os.path.join(directory, name), 700, (d, i))
+            write_file(os.path.join(directory, "keep.o"), 100, (d, "keep"))
+            write_file(os.path.join(directory, "local3-cache"), 100, (d, "cache"))
+            write_file(os.path.join(directory, "build%d" % (d % 100), "out.bin"), 100, (d, "build"))
+    for (dirpath, dirnames, filenames) in os.walk(root):
+        os.utime(dirpath, (_old_mtime, _old_mtime))
+
+def make_log(root, capture, blocks, per_block, section):
+    # blocks as `update` would append them, switching the hashing every `section` blocks
+    last_root = ""
+    roots = {}
+    hashing = ""
+    lines = ["#timehashblock v" + str(capture._log_version)]
+    for b in range(blocks):
+        block_hashing = _log_hashings[(b // section) % len(_log_hashings)]
+        if block_hashing != hashing:
+            hashing = block_hashing
+            lines.append("#hashing " + hashing)
+        new_hashes = [hashlib.new(hashing, ("%d-%d" % (b, i)).encode("utf-8")).hexdigest() for i in range(per_block)]
+        block = capture.build_block(new_hashes, last_root, roots.get(hashing, ""), hashing)
+        lines.append(block["data"])
+        lines.append("#root " + block["root"])
+        if b % 10 == 0:
+            lines.append("#publish evm ok 1 0.42 0x" + block["root"][:64])
+        last_root = block["root"]
+        roots[hashing] = last_root
+    with open(os.path.join(root, capture._log_file), "w") as f:
+        f.write("\n".join(lines) + "\n")
+    return blocks * per_block
+
+def measure(function, repeat, memory, setup=None):
+    # best of `repeat` runs, peak memory from one more run under tracemalloc
+    times = []
+    result = None
+    for i in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    peak = None
+    if memory:
+        if setup is not None:
+            setup()
+        tracemalloc.start()
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {"seconds": min(times), "runs": [round(t, 6) for t in times], "peak_bytes": peak}, result
+
+def with_rate(entry, count, unit, size=None):
+    entry[unit] = count
+    entry[unit + "_per_s"] = count / entry["seconds"] if entry["seconds"] > 0 else None
+    if size is not None:
+        entry["bytes"] = size
+        entry["mb_per_s"] = size / 1e6 / entry["seconds"] if entry["seconds"] > 0 else None
+    return entry
+
+def tree_benchmarks(root, kind, args, capture, hashblock, digestcache, walker):
+    results = {}
+    hashing = args.hashing
+    with in_directory(root):
+        files = list(walker.walk(".", ".gitignore", capture._state_ignore_lines))
+        count = len(files)
+        size = sum(entry.stat().st_size for (path, entry) in files)
+        entry, new_hashes = measure(lambda: capture.get_new_hashes({hashing: set()}, [hashing], None, args.jobs),
+                                    args.repeat, args.memory)
+        results["get_new_hashes/" + kind + "/cold"] = with_rate(entry, count, "files", size)
+        cache = digestcache.DigestCache(capture._digest_cache_file)
+        capture.get_new_hashes({hashing: set()}, [hashing], cache, args.jobs)
+        cache.save()
+        def warm():
+            cache = digestcache.DigestCache(capture._digest_cache_file)
+            return capture.get_new_hashes({hashing: set()}, [hashing], cache, args.jobs)
+        entry, warm_hashes = measure(warm, args.repeat, args.memory)
+        assert warm_hashes == new_hashes
+        results["get_new_hashes/" + kind + "/warm"] = with_rate(entry, count, "files", size)
+        hashfile = "bench-hashes"
+        def remove_hashfile():
+            if os.path.exists(hashfile):
+                os.remove(hashfile)
+        def scan():
+            block = hashblock.HashBlock(hashing)
+            block.scan(".gitignore", hashfile, None, args.jobs)
+            return block
+        entry, block = measure(scan, args.repeat, args.memory, remove_hashfile)
+        remove_hashfile()
+        results["scan/" + kind] = with_rate(entry, count, "files", size)
+    return results
+
+def log_benchmarks(root, args, capture):
+    results = {}
+    settings = configparser.ConfigParser()
+    settings["default"] = capture._config["default"]
+    settings["default"]["hashing"] = _log_hashings[0]
+    with in_directory(root):
+        digests = make_log(".", capture, int(5000 * args.scale), 20, 500)
+        size = os.path.getsize(capture._log_file)
+        def remove_checkpoint():
+            shutil.rmtree(capture._tsb_dir)
+            os.makedirs(capture._tsb_dir)
+        entry, state = measure(lambda: capture.evaluate_previous_logs(settings), args.repeat, args.memory,
+                               remove_checkpoint)
+        results["evaluate_previous_logs/replay"] = with_rate(entry, digests, "digests", size)
+        entry, checkpointed = measure(lambda: capture.evaluate_previous_logs(settings), args.repeat, args.memory)
+        hashing = _log_hashings[0]
+        assert checkpointed[1:] == state[1:] and len(checkpointed[0][hashing]) == len(state[0][hashing])
+        results["evaluate_previous_logs/checkpoint"] = with_rate(entry, digests, "digests", size)
+        (hash_sets, last_root, proper_roots, log_hashing, log_version) = state
+        last_proper_root = proper_roots.get(args.hashing, "")
+        for count in (1000, int(100000 * args.scale)):
+            new_hashes = [hashlib.new(args.hashing, str(i).encode("utf-8")).hexdigest() for i in range(count)]
+            entry, block = measure(lambda: capture.build_block(new_hashes, last_root, last_proper_root, args.hashing),
+                                   args.repeat, args.memory)
+            results["build_block/" + str(count)] = with_rate(entry, count, "digests")
+    return results
+
+def compare(results, baseline, threshold):
+    # (name, baseline seconds, seconds, ratio, verdict) for every benchmark in both
+    rows = []
+    for name in results["benchmarks"]:
+        if name not in baseline["benchmarks"]:
+            continue
+        old = baseline["benchmarks"][name]["seconds"]
+        new = results["benchmarks"][name]["seconds"]
+        ratio = new / old if old > 0 else float("inf")
+        verdict = "same"
+        if ratio > 1 + threshold:
+            verdict = "slower"
+        elif ratio < 1 - threshold:
+            verdict = "faster"
+        rows.append((name, old, new, ratio, verdict))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scale', type=float, default=1.0, help="size factor for all synthetic data")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('-j', '--jobs', type=int, default=None)
+    parser.add_argument('-s', '--hashing', default="sha384")
+    parser.add_argument('--only', nargs="+", default=list(_tree_kinds) + ["log"],
+                        help="subset of " + str(_tree_kinds + ("log",)))
+    parser.add_argument('--no-memory', dest="memory", action="store_false", help="skip the tracemalloc runs")
+    parser.add_argument('--workdir', default=None, help="keep the synthetic data here instead of a temp dir")
+    parser.add_argument('-o', '--output', default=None, help="write results as JSON (default: stdout)")
+    parser.add_argument('--baseline', default=None, help="JSON results of an earlier run to compare with")
+    parser.add_argument('--threshold', type=float, default=0.1, help="relative change that counts, default 0.1")
+    args = parser.parse_args()
+    workdir = args.workdir or tempfile.mkdtemp(prefix="tsb-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    with in_directory(workdir):
+        #capture creates its state directory and reads .env on import
+        import capture
+        import hashblock
+        import digestcache
+        import walker
+    results = {
+        "meta": {
+            "time": int(time.time()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "scale": args.scale,
+            "repeat": args.repeat,
+            "jobs": args.jobs,
+            "hashing": args.hashing,
+        },
+        "benchmarks": {},
+    }
+    try:
+        for kind in _tree_kinds:
+            if kind not in args.only:
+                continue
+            root = os.path.join(workdir, kind)
+            if not os.path.exists(root):
+                os.makedirs(os.path.join(root, capture._tsb_dir))
+                make_tree(root, kind, args.scale)
+            print("tree", kind, "...", file=sys.stderr)
+            results["benchmarks"].update(tree_benchmarks(root, kind, args, capture, hashblock, digestcache, walker))
+        if "log" in args.only:
+            root = os.path.join(workdir, "log")
+            os.makedirs(os.path.join(root, capture._tsb_dir), exist_ok=True)
+            print("log ...", file=sys.stderr)
+            results["benchmarks"].update(log_benchmarks(root, args, capture))
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir)
+    exit_code = 0
+    if args.baseline is not None:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        rows = compare(results, baseline, args.threshold)
+        results["comparison"] = [
+            {"name": name, "baseline_seconds": old, "seconds": new, "ratio": round(ratio, 4), "verdict": verdict}
+            for (name, old, new, ratio, verdict) in rows
+        ]
+        for (name, old, new, ratio, verdict) in rows:
+            print("%-40s %10.4fs -> %10.4fs  x%6.3f  %s" % (name, old, new, ratio, verdict), file=sys.stderr)
+        if any(verdict == "slower" for (name, old, new, ratio, verdict) in rows):
+            exit_code = 1
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    sys.exit(exit_code)
+
+if __name__ == "__main__":
+    main()
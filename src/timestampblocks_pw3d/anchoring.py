@@ -0,0 +1,93 @@
+import os
+import time
+import merkle
+
+# anchor aggregation: block roots are queued in a spool file and published
+# on chain as one merkle root once enough of them piled up (or the oldest one
+# waited long enough)
+#
+# spool file format:
+# | root timestamp hashing
+# more lines
+#
+# Log lines written for a published aggregate:
+# | #aggregate <aggregate_root> <hashing> <count>
+# | #anchor <block_root> <aggregate_root> <proof>
+# more anchor lines
+# with proof as comma separated `side:sibling` pairs (see merkle.py), or "-"
+# for a single queued root.
+
+class AnchorSpool:
+    spoolfile = None
+    size = 0 #publish once this many roots are queued, 0 to disable
+    interval = 0 #publish once the oldest root waited this many seconds, 0 to disable
+    entries = None #list of (root, timestamp, hashing)
+
+    def __init__(self, spoolfile, size=0, interval=0):
+        self.spoolfile = spoolfile
+        self.size = size
+        self.interval = interval
+        self.entries = []
+        if os.path.exists(spoolfile):
+            with open(spoolfile, "r") as f:
+                for line in f:
+                    try:
+                        (root, timestamp, hashing) = line.split()
+                        self.entries.append((root, int(timestamp), hashing))
+                    except ValueError:
+                        pass
+
+    def enabled(self):
+        return self.size > 0 or self.interval > 0
+
+    def add(self, root, timestamp, hashing):
+        self.entries.append((root, timestamp, hashing))
+        with open(self.spoolfile, "a") as f:
+            f.write(" ".join([root, str(timestamp), hashing]) + "\n")
+
+    def due(self, now=None):
+        if len(self.entries) == 0:
+            return False
+        if now is None:
+            now = int(time.time())
+        if self.size > 0 and len(self.entries) >= self.size:
+            return True
+        return self.interval > 0 and now - min(entry[1] for entry in self.entries) >= self.interval
+
+    def aggregate(self, hashing):
+        # returns (block, anchor lines) for all queued roots
+        roots = [entry[0] for entry in self.entries]
+        leaves = [bytes.fromhex(root) for root in roots]
+        aggregate_root = merkle.merkle_root(leaves, hashing).hex()
+        timestamp = int(time.time())
+        block = {
+            "root": aggregate_root,
+            "data": " ".join(roots),
+            "timestamp": timestamp,
+            "hashed_files": roots,
+            "hashing": hashing,
+        }
+        lines = ["#aggregate " + " ".join([aggregate_root, hashing, str(len(roots))])]
+        for index in range(len(roots)):
+            proof = merkle.merkle_proof(leaves, index, hashing)
+            lines.append("#anchor " + " ".join([roots[index], aggregate_root, encode_proof(proof)]))
+        return block, lines
+
+    def clear(self):
+        self.entries = []
+        with open(self.spoolfile, "w"):
+            pass
+
+def encode_proof(proof):
+    if len(proof) == 0:
+        return "-"
+    return ",".join(side + ":" + sibling for (side, sibling) in proof)
+
+def decode_proof(text):
+    if text == "-":
+        return []
+    return [tuple(pair.split(":")) for pair in text.split(",")]
+
+def verify_anchor(block_root, aggregate_root, proof_text, hashing):
+    node = merkle.root_from_proof(bytes.fromhex(block_root), decode_proof(proof_text), hashing)
+    return node.hex() == aggregate_root
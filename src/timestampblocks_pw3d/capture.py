@@ -15,30 +15,62 @@
 
 import configparser
 import argparse
-import hashblock
+import digestcache
+import logcheckpoint
+import hashengine
+import walker
+import merkle
+import publishing
+import anchoring
+import watcher
+import channels
+import instrument
+import knownhashes
+import treehash
+import gitbackend
+import stream
+import threading
+import queue
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import os
 import hashlib
-import pathspec
+import json
+import sys
 from pathlib import Path
 import time
 from datetime import datetime
 from dotenv import dotenv_values
-from web3 import Web3
 
-from iota_client import IotaClient
-
-_possible_publish = ("git", "iota", "shell", "evm")
-_available_commands = ("update", "query-settings")
+_local_channels = ("shell", "git") #run in the main thread, they may ask for input
+_available_commands = ("update", "query-settings", "prove", "verify-proof", "anchor", "watch", "verify", "lookup")
 _tsb_dir = ".timestampblocks/"
 if not os.path.exists(_tsb_dir):
     os.makedirs(_tsb_dir)
 _config_file = _tsb_dir + "config"
+_digest_cache_file = _tsb_dir + "digests"
+_log_checkpoint_file = _tsb_dir + "log-checkpoint"
+_known_hashes_prefix = _tsb_dir + "known-"
+_digest_index_prefix = _tsb_dir + "index-"
+_anchor_spool_file = _tsb_dir + "anchor-spool"
 #_tree_file = _tsb_dir + "tree"
 #_last_hash_set = _tsb_dir + "hash_set"
 _log_file = "timestampblocks.log"
-_log_version=1
-_blocksize = 65536
+# never hashed: the log itself and everything this program keeps next to the config
+_state_ignore_lines = [_log_file, "/" + _tsb_dir + "*", "!/" + _config_file]
+_log_version=2
+_leaf_separator = stream._leaf_separator #v2 data lines: header tokens, separator, file digests
+_blocksize = None #adaptive, see hashengine.pick_blocksize; `blocksize` in [default] overrides
 _publish_even_if_no_changes = False
+_watch_interval = 60.0 #seconds from the first change to its block
+_watch_changes = 1000 #new digests that trigger a block right away
+_watch_debounce = 0.5 #seconds without events before touched files get hashed
+_watch_poll = 2.0 #seconds between scans if inotify is not available
+_watch_spool_check = 10.0 #seconds between checks of the anchor spool while no block is due
+_verify_chunk = 64 #blocks per root verification task
+_verify_files_chunk = 512 #files per hashing batch of `verify`
+_lookup_read = 1048576 #bytes per read while looking for the `#root` line of a block
+_lookup_header = 512 #bytes read for the timestamp of a block
 
 _dotenv = dotenv_values(".env")
 
@@ -46,6 +78,7 @@ _config = {
     "default": {
         "publish": "git shell",
         "hashing": "sha384",
+        "blocksize": "auto",
     },
     "iota": {
         "protocol": "iota",
@@ -74,21 +107,42 @@ def main():
     parser.add_argument('-s', '--hashing', nargs=1, default=[settings["default"]["hashing"]],
                         metavar="algorithm",
                         help="options are "+str(hashlib.algorithms_available)+",\n"+
+                        "several (quoted, space separated) are hashed in one pass,\n"+
+                        "'<algorithm>-tree-<chunk size>' (e.g. sha256-tree-4m) hashes chunks of big files in parallel,\n"+
                         "(setting is '" + settings["default"]["hashing"]+"')")
     parser.add_argument('-p', '--publish', nargs="+", default=settings["default"]["publish"].split(),
                         metavar="channel",
-                        help="options are "+str(_possible_publish)+",\n"+
+                        help="options are "+str(channels.names())+" or a plugin protocol,\n"+
                         "(setting is " + str(settings["default"]["publish"].split())+")")
     parser.add_argument('-d', '--dummy', action="store_true",
                         help="only print on shell and do not push or write block updates otherwise")
+    parser.add_argument('-j', '--jobs', type=int, default=None, metavar="N",
+                        help="number of parallel hashing workers (default is the number of CPUs)")
+    parser.add_argument('--interval', type=float, default=None, metavar="seconds",
+                        help="watch: emit a block this long after the first change (setting 'watch-interval')")
+    parser.add_argument('--max-changes', type=int, default=None, metavar="N",
+                        help="watch: emit a block once N new digests are pending (setting 'watch-changes')")
+    parser.add_argument('--no-cache', action="store_true",
+                        help="neither read nor write the digest cache in '" + _digest_cache_file + "'")
+    parser.add_argument('--rehash', action="store_true",
+                        help="ignore cached digests and hash every file again (cache is rewritten)")
 #    parser.add_argument('-m', '--message', nargs=1, metavar="text",
 #                        help="optional message where publishing channel allows a message")
 #    parser.add_argument('-', '--parameters', nargs="+",
 #                        metavar="path",
 #                        help="files to be selected")
-#    parser.add_argument('params', nargs="*",
-#                        metavar="path [path ...]",
-#                        help="files to be selected")
+    parser.add_argument('--stats', action="store_true",
+                        help="print time per phase, files, bytes and publish latency at the end")
+    parser.add_argument('--stats-json', default=None, metavar="file",
+                        help="write the same statistics as JSON to file")
+    parser.add_argument('--profile', default=None, metavar="phase",
+                        help="run cProfile during one phase (e.g. walk, hash, replay, publish or the command)")
+    parser.add_argument('--profile-out', default=None, metavar="file",
+                        help="write the --profile data to file instead of printing the top entries")
+    parser.add_argument('params', nargs="*",
+                        metavar="path [path ...]",
+                        help="files to be selected ('prove' takes a file and for tree hashings optionally a byte offset, "+
+                        "'verify-proof' a proof file, 'lookup' a file or a digest)")
     args = parser.parse_args()
 
     if args.hashing != None:
@@ -96,101 +150,363 @@ def main():
     if len(args.publish) > 0:
         settings["default"]["publish"] = ' '.join(args.publish)
 
-#    params = args.params
+    params = args.params
 #    if args.parameters != None:
 #        assert len(args.params)==0, "either use parameters or params, it's confusing if you use both"
 #        params = args.parameters
 
     command = args.command[0]
-    if command == "query-settings":
-#        assert len(params) == 0, "no parameters allowed for this command!"
-        assert not args.dummy, "settings update not possible as dummy version yet"
-        settings = query_configuration(settings)
-        with open(_config_file, "w") as configfile:
-            settings.write(configfile)
-    elif command == "update":
-        hash_set, last_root, last_proper_root = evaluate_previous_logs(settings)
-        new_hashes = get_new_hashes(hash_set, settings["default"]["hashing"])
-        if len(new_hashes) > 0 or _publish_even_if_no_changes:
-            new_block = build_block(new_hashes, last_root, last_proper_root, settings["default"]["hashing"])
-            if not args.dummy:
-                with open(_log_file, "a") as f:
-                    if (last_root != last_proper_root):
-                        f.write("#hashing "+settings["default"]["hashing"]+"\n")
-                    f.write(new_block["data"]+"\n")
-                    f.write("#root " + new_block["root"]+"\n")
-            else:
-                print("-dummy-", "not actually writing log file")
-            publishers = settings["default"]["publish"].split()
-            for channel in publishers:
-                publish(channel, new_block, args.assume_yes, args.dummy)
+    instrument.enabled = args.stats or args.stats_json is not None
+    if args.profile is not None:
+        instrument.profile_with_cprofile(args.profile, args.profile_out)
+    try:
+        with instrument.phase(command):
+            if command == "query-settings":
+#                assert len(params) == 0, "no parameters allowed for this command!"
+                assert not args.dummy, "settings update not possible as dummy version yet"
+                settings = query_configuration(settings)
+                with open(_config_file, "w") as configfile:
+                    settings.write(configfile)
+            elif command == "update":
+                hashings = get_hashings(settings)
+                hash_sets, last_root, proper_roots, log_hashing, log_version = evaluate_previous_logs(settings)
+                upgrade_log_version(log_version, args.dummy)
+                cache = digestcache.DigestCache(_digest_cache_file, enabled=not args.no_cache, rehash=args.rehash)
+                changed = []
+                scanned = []
+                new_hashes = get_new_hashes(hash_sets, hashings, cache, args.jobs, get_blocksize(settings), changed,
+                                            scanned)
+                if not args.dummy:
+                    cache.save()
+                (blocks, last_root, log_hashing) = append_blocks(new_hashes, hashings, last_root, proper_roots,
+                                                                 log_hashing, args.dummy)
+                if len(blocks) > 0:
+                    blocks[-1]["paths"] = [path.replace(os.sep, "/") for path in changed]
+                    blocks[-1]["scanned"] = [path.replace(os.sep, "/") for path in scanned]
+                    publish_blocks(blocks, args.assume_yes, args.dummy, settings)
+                else:
+                    print("no updates detected")
+                    publish_due_aggregate(args.assume_yes, args.dummy, settings)
+            elif command == "watch":
+                watch(settings, args)
+            elif command == "verify":
+                if not verify(settings, args.jobs, get_blocksize(settings)):
+                    sys.exit(1)
+            elif command == "anchor":
+                # publish queued roots right away, regardless of thresholds
+                spool = get_anchor_spool(settings)
+                if len(spool.entries) == 0:
+                    print("no roots queued")
+                else:
+                    remote = [channel for channel in settings["default"]["publish"].split() if channel not in _local_channels]
+                    publish_aggregate(spool, remote, args.assume_yes, args.dummy, settings)
+            elif command == "prove":
+                assert len(params) in (1, 2), "prove needs a path and optionally a byte offset"
+                offset = int(params[1]) if len(params) == 2 else None
+                proof = prove(params[0], get_hashings(settings)[0], get_blocksize(settings), offset, args.jobs)
+                if proof is None:
+                    print("no block found containing", params[0], "with hashing", get_hashings(settings)[0])
+                    sys.exit(1)
+                print(json.dumps(proof, indent=1))
+            elif command == "lookup":
+                assert len(params) == 1, "lookup needs exactly one path or digest"
+                if not Path(_log_file).exists():
+                    print("no", _log_file, "yet")
+                    sys.exit(1)
+                if not lookup(settings, params[0], get_blocksize(settings), args.jobs):
+                    sys.exit(1)
+            elif command == "verify-proof":
+                assert len(params) == 1, "verify-proof needs exactly one proof file"
+                with open(params[0], "r") as f:
+                    proof = json.load(f)
+                if not verify_proof(proof, get_blocksize(settings)):
+                    sys.exit(1)
+    finally:
+        instrument.finish()
+        if instrument.enabled:
+            report_stats(args.stats, args.stats_json)
+
+def report_stats(show, jsonfile):
+    if show:
+        print("\n".join(instrument.summary_lines()))
+    if jsonfile is not None:
+        with open(jsonfile, "w") as f:
+            json.dump(instrument.report(), f, indent=1)
+
+def get_hashings(settings):
+    # `hashing` may list several algorithms, the first one is the primary (prove, aggregation)
+    return settings["default"]["hashing"].split()
+
+def append_blocks(new_hashes, hashings, last_root, proper_roots, log_hashing, dummy):
+    # one block per algorithm with new digests, chained through last_root
+    # returns (blocks, last_root, log_hashing), proper_roots is updated in place
+    blocks = []
+    for hashing in hashings:
+        if len(new_hashes[hashing]) == 0 and not _publish_even_if_no_changes:
+            continue
+        block = build_block(new_hashes[hashing], last_root, proper_roots.get(hashing, ""), hashing)
+        append_block(block, log_hashing, dummy)
+        last_root = block["root"]
+        proper_roots[hashing] = block["root"]
+        log_hashing = hashing
+        blocks.append(block)
+    return blocks, last_root, log_hashing
+
+def publish_blocks(blocks, assume_yes, dummy, settings):
+    # the last block names the root before it, so publishing it covers the whole chain
+    for block in blocks[:-1]:
+        print("block", block["root"], "(" + block["hashing"] + ",", len(block["hashed_files"]),
+              "digests) is covered by the next block")
+    publish_block(blocks[-1], assume_yes, dummy, settings)
+
+def append_block(block, log_hashing, dummy):
+    if dummy:
+        print("-dummy-", "not actually writing log file")
+        return
+    with open(_log_file, "a") as f:
+        if log_hashing != block["hashing"]:
+            f.write("#hashing "+block["hashing"]+"\n")
+        f.write(block["data"]+"\n")
+        f.write("#root " + block["root"]+"\n")
+
+def publish_block(block, assume_yes, dummy, settings):
+    publishers = settings["default"]["publish"].split()
+    spool = get_anchor_spool(settings)
+    if spool.enabled():
+        remote = [channel for channel in publishers if channel not in _local_channels]
+        if dummy:
+            print("-dummy-", "not queueing root for aggregated publishing on", remote)
         else:
-            print("no updates detected")
-
-def publish(channel, block, assume_yes, dummy):
-    response = None
-    if channel == "shell":
-        response = publish_shell(block, assume_yes, dummy)
-    elif channel == "git":
-        response = publish_git(block, assume_yes, dummy)
-    elif channel == "iota":
-        response = publish_iota(block, assume_yes, dummy)
-    else:
-        settings = configparser.ConfigParser()
-        settings.read(_config_file)
-        if settings.has_section(channel):
-            if settings[channel]["protocol"] == "evm":
-                response = publish_evm(block, assume_yes, dummy, channel=channel)
-            else:
-                print("Custom channel not implemented yet!", channel, block, assume_yes, dummy)
+            spool.add(block["root"], block["timestamp"], block["hashing"])
+        if spool.due():
+            publish_aggregate(spool, remote, assume_yes, dummy, settings)
         else:
-            print("Channel not implemented yet!", channel, block, assume_yes, dummy)
-    if response != None:
-        # TODO log the response (likely a transaction id)
-        print("response:", response)
-        pass
-
-#    elif publishing_method == 'iota':
-#        pass
-#    elif publishing_method == 'polygon':
-#        pass
-#    elif publishing_method == 'arbitrum':
-#        pass
-#    elif publishing_method == 'bitcoin':
-#        pass
-#    elif publishing_method == 'ethereum':
-#        pass
-
-def publish_evm(block, assume_yes, dummy=False, channel="evm"):
-    settings = configparser.ConfigParser()
-    settings.read(_config_file)
-    if not settings.has_section(channel):
-        settings = _config
-    web3 = Web3(Web3.HTTPProvider(settings[channel]["node"] + _dotenv[settings[channel]["api-key"]]))
-    account = web3.eth.account.from_key(_dotenv[settings[channel]["private-key"]])
-    nonce = web3.eth.getTransactionCount(account.address)
-    recipient = web3.toChecksumAddress("0x" + block["root"][:40]) #trick to publish block_root via to_address
-    tx = {
-        "nonce": nonce,
-        "to": recipient,
-        "value": 0,
-        "gas": 20000000,
-        "gasPrice": web3.eth.gasPrice
-    }
-    signed_tx = account.sign_transaction(tx)
-#    signed_tx = web3.eth.account.sign.transaction(tx, _dotenv[settings[channel]["private-key"]])
+            print(len(spool.entries), "root(s) queued for aggregated publishing on", remote)
+        publishers = [channel for channel in publishers if channel in _local_channels]
+    publish_channels(publishers, block, assume_yes, dummy, settings)
+
+def watch(settings, args):
+    # long running update: known digests stay in memory, only touched files get hashed
+    hashings = get_hashings(settings)
+    blocksize = get_blocksize(settings)
+    interval = args.interval or float(settings["default"].get("watch-interval", _watch_interval))
+    max_changes = args.max_changes or int(settings["default"].get("watch-changes", _watch_changes))
+    debounce = float(settings["default"].get("watch-debounce", _watch_debounce))
+    hash_sets, last_root, proper_roots, log_hashing, log_version = evaluate_previous_logs(settings)
+    upgrade_log_version(log_version, args.dummy)
+    cache = digestcache.DigestCache(_digest_cache_file, enabled=not args.no_cache, rehash=args.rehash)
+    rules = walker.IgnoreRules(".", ".gitignore", _state_ignore_lines)
+    source = watcher.open_source(rules, float(settings["default"].get("watch-poll", _watch_poll)))
+    # catch up with changes made while nobody was watching
+    changed = []
+    scanned = []
+    new_hashes = get_new_hashes(hash_sets, hashings, cache, args.jobs, blocksize, changed, scanned)
+    pending = {hashing: dict.fromkeys(new_hashes[hashing]) for hashing in hashings}
+    pending_paths = dict.fromkeys(path.replace(os.sep, "/") for path in changed)
+    pending_scanned = [path.replace(os.sep, "/") for path in scanned]
+    pending_count = max(len(pending[hashing]) for hashing in hashings)
+    first_pending = time.monotonic() if pending_count > 0 else None
+    touched = set()
+    first_touched = None
+    last_event = 0.0
+    last_spool_check = 0.0
+    print("watching for changes, block interval", interval, "s, max changes", max_changes)
+    try:
+        while True:
+            timeout = debounce if len(touched) > 0 else min(1.0, interval)
+            (paths, rescan) = source.poll(timeout)
+            now = time.monotonic()
+            if rescan:
+                paths = {path for (path, entry) in walker.walk(".", ".gitignore", _state_ignore_lines)}
+            if len(paths) > 0:
+                if first_touched is None:
+                    first_touched = now
+                touched.update(paths)
+                last_event = now
+            if len(touched) > 0 and (now - last_event >= debounce or len(touched) >= max_changes
+                                     or now - first_touched >= interval):
+                filenames = sorted(path for path in touched if os.path.isfile(path))
+                digests = hashengine.hash_files(filenames, tuple(hashings), args.jobs, cache, blocksize)
+                for (filename, file_digests) in zip(filenames, digests):
+                    if file_digests is None:
+                        print("could not read", filename, "- skipped")
+                        continue
+                    # touched files go to git with the next block, even if their content is known (e.g. renames)
+                    pending_paths[filename] = None
+                    for (hashing, hash_value) in zip(hashings, file_digests):
+                        if hash_value not in hash_sets[hashing] and hash_value not in pending[hashing]:
+                            pending[hashing][hash_value] = None
+                            if first_pending is None:
+                                first_pending = now
+                pending_count = max(len(pending[hashing]) for hashing in hashings)
+                touched = set()
+                first_touched = None
+            if pending_count > 0 and (pending_count >= max_changes or now - first_pending >= interval):
+                new_hashes = {hashing: list(pending[hashing]) for hashing in hashings}
+                (blocks, last_root, log_hashing) = append_blocks(new_hashes, hashings, last_root, proper_roots,
+                                                                 log_hashing, args.dummy)
+                blocks[-1]["paths"] = list(pending_paths)
+                blocks[-1]["scanned"] = pending_scanned
+                publish_blocks(blocks, args.assume_yes, args.dummy, settings)
+                for hashing in hashings:
+                    hash_sets[hashing].update(pending[hashing])
+                pending = {hashing: {} for hashing in hashings}
+                pending_paths = {}
+                pending_scanned = []
+                pending_count = 0
+                first_pending = None
+                if not args.dummy:
+                    cache.save()
+            elif now - last_spool_check >= _watch_spool_check:
+                # queued roots have to go out on time even while nothing changes
+                last_spool_check = now
+                publish_due_aggregate(args.assume_yes, args.dummy, settings)
+    except KeyboardInterrupt:
+        print("stopped watching,", pending_count, "new digest(s) not in a block yet")
+    finally:
+        source.close()
+        if not args.dummy:
+            cache.save()
+
+def get_anchor_spool(settings):
+    return anchoring.AnchorSpool(_anchor_spool_file,
+                                 int(settings["default"].get("aggregate-size", "0")),
+                                 int(settings["default"].get("aggregate-interval", "0")))
+
+def publish_due_aggregate(assume_yes, dummy, settings):
+    # for runs without a new block, publish_block checks the spool otherwise
+    spool = get_anchor_spool(settings)
+    if spool.enabled() and spool.due():
+        remote = [channel for channel in settings["default"]["publish"].split() if channel not in _local_channels]
+        publish_aggregate(spool, remote, assume_yes, dummy, settings)
+
+def publish_aggregate(spool, selected, assume_yes, dummy, settings):
+    # one merkle root over all queued block roots, every block gets its anchor proof in the log
+    (block, anchor_lines) = spool.aggregate(get_hashings(settings)[0])
+    print("aggregating", len(spool.entries), "root(s) into", block["root"])
     if dummy:
-        print("-dummy-", "not publishing on", channel, signed_tx)
+        print("-dummy-", "not writing anchors to", _log_file)
+        publish_channels(selected, block, assume_yes, dummy, settings)
+        return
+    # the aggregate line goes first so the publish results follow it, anchors only once published
+    with open(_log_file, "a") as f:
+        f.write(anchor_lines[0] + "\n")
+    results = publish_channels(selected, block, assume_yes, dummy, settings)
+    if len(selected) == 0 or any(result["status"] == "ok" for result in results):
+        with open(_log_file, "a") as f:
+            for line in anchor_lines[1:]:
+                f.write(line + "\n")
+        spool.clear()
     else:
-        tx_hash = web3.eth.sendRawTransaction(signed_tx.rawTransaction)
-        return tx_hash
+        print("aggregate not published, roots stay queued")
 
-def publish_iota(block, assume_yes, dummy=False):
-    settings = configparser.ConfigParser()
-    settings.read(_config_file)
+def channel_limits(channel, settings):
+    # (timeout, retries, backoff) from the channel's config section
+    timeout = publishing._default_timeout
+    retries = publishing._default_retries
+    backoff = publishing._default_backoff
+    if settings.has_section(channel):
+        timeout = float(settings[channel].get("timeout", timeout))
+        retries = int(settings[channel].get("retries", retries))
+        backoff = float(settings[channel].get("backoff", backoff))
+    return timeout, retries, backoff
+
+def publish_channels(selected, block, assume_yes, dummy, settings):
+    with instrument.phase("publish"):
+        results = _publish_channels(selected, block, assume_yes, dummy, settings)
+    for result in results:
+        instrument.record_channel(result)
+    return results
+
+def _publish_channels(selected, block, assume_yes, dummy, settings):
+    # remote channels fan out concurrently while shell prints, git goes last
+    # so that its commit already contains the recorded publish results
+    tasks = {}
+    for channel in dict.fromkeys(selected):
+        (timeout, retries, backoff) = channel_limits(channel, settings)
+        if channel in _local_channels or channels.protocol_of(channel, settings) not in channels.names(plugins=True):
+            # an unknown protocol fails right away, retrying would not change that
+            retries = 0
+        tasks[channel] = publishing.ChannelTask(
+            channel, lambda channel=channel: publish(channel, block, assume_yes, dummy, settings),
+            timeout, retries, backoff
+        )
+    remote = [tasks[channel] for channel in tasks if channel not in _local_channels]
+    results = {}
+    for task in remote:
+        task.start()
+    if "shell" in tasks:
+        results["shell"] = publishing.run_inline(tasks["shell"])
+    for task in remote:
+        results[task.channel] = task.wait()
+        print_publish_result(results[task.channel])
+    if dummy:
+        print("-dummy-", "not recording publish results in", _log_file)
+    else:
+        record_publish_results([results[task.channel] for task in remote])
+    if "git" in tasks:
+        results["git"] = publishing.run_inline(tasks["git"])
+        if results["git"]["error"] is not None:
+            print_publish_result(results["git"])
+    return [results[channel] for channel in tasks]
+
+def response_text(response):
+    # single token representation of a publish response (transaction id, block id)
+    if response is None:
+        return "-"
+    if isinstance(response, (list, tuple)) and len(response) > 0:
+        return response_text(response[0])
+    if isinstance(response, (bytes, bytearray)):
+        return "0x" + bytes(response).hex()
+    if hasattr(response, "hex") and callable(response.hex):
+        return response.hex()
+    return "_".join(str(response).split())
+
+def print_publish_result(result):
+    if result["status"] == "ok":
+        print("published on", result["channel"] + ":", response_text(result["response"]),
+              "(" + str(result["seconds"]) + "s)")
+    else:
+        print("publishing on", result["channel"], result["status"], "after", result["attempts"], "attempt(s):",
+              result["error"] or "no result within " + str(result["seconds"]) + "s")
+
+def record_publish_results(results):
+    # one line per channel right after the block's root, ignored when reading blocks
+    if len(results) == 0:
+        return
+    with open(_log_file, "a") as f:
+        for result in results:
+            if result["status"] == "ok":
+                text = response_text(result["response"])
+            else:
+                text = "_".join(str(result["error"] or result["status"]).split())
+            f.write(" ".join(["#publish", result["channel"], result["status"], str(result["attempts"]),
+                              str(result["seconds"]), text]) + "\n")
+
+def publish(channel, block, assume_yes, dummy, settings):
+    # backends are imported by the registry on first use, see channels.py
+    protocol = channels.protocol_of(channel, settings)
+    function = channels.get(protocol)
+    if function is None:
+        raise ValueError("channel " + channel + " not implemented (protocol " + protocol + "), block " + block["root"] +
+                         " not published there")
+    return function(block, assume_yes, dummy, channel, settings)
+
+def publish_evm(block, assume_yes, dummy=False, channel="evm", settings=None):
+    import evm
+    if settings is None or not settings.has_section(channel):
+        settings = _config
+    timeout = float(settings[channel].get("timeout", publishing._default_timeout))
+    gas_price_ttl = float(settings[channel].get("gas-price-ttl", evm._gas_price_ttl))
+    publisher = evm.get_publisher(settings[channel]["node"] + _dotenv[settings[channel]["api-key"]],
+                                  _dotenv[settings[channel]["private-key"]], timeout, gas_price_ttl)
+    return publisher.publish(block["root"], dummy, channel)
+
+def publish_iota(block, assume_yes, dummy=False, channel="iota", settings=None):
+    from iota_client import IotaClient
     node_uri = _config["iota"]["node"]
-    if settings.has_section("iota"):
-        node_uri = settings["iota"]["node"]
+    if settings is not None and settings.has_section(channel):
+        node_uri = settings[channel]["node"]
     client = IotaClient({'nodes': [node_uri]})
     options = {
         "tag": "0x" + "timehashblock".encode("utf-8").hex(),
@@ -202,164 +518,568 @@ def publish_iota(block, assume_yes, dummy=False):
         response = client.build_and_post_block(None, options)
         return response
 
-def publish_git(block, assume_yes, dummy=False):
-    if len(str(os.popen("git check-ignore .env").read())) == 0:
+def ask(question, assume_yes):
+    print(question, "(Yn)")
+    inp = "Y"
+    if assume_yes:
+        print(inp)
+    else:
+        inp = input()
+    return inp != "n"
+
+def publish_git(block, assume_yes, dummy=False, channel="git", settings=None):
+    # stages the log, the paths the scan found changed, modified tracked and untracked scanned paths
+    # (unless git ignores them), commits via plumbing
+    # optional settings in the channel's section: remote, branch, push (yes/no)
+    section = settings[channel] if settings is not None and settings.has_section(channel) else {}
+    repo = gitbackend.GitRepository(".", dummy)
+    ignored = repo.ignored([".env", _log_file])
+    paths = list(dict.fromkeys(block.get("paths", [])))
+    if ".env" not in ignored:
         print(".env file is not excluded from git!")
-        print("Add .env to .gitignore? (Yn)")
-        inp = "Y"
-        if assume_yes:
-            print(inp)
-        else:
-            inp = input()
-        if inp != "n":
-            with open(".gitignore", "a") as file:
-                file.write(".env")
-    if len(str(os.popen("git ls-files ./" + _log_file).read())) == 0:
-        print(_log_file, "is ignored by git")
-        print("Run 'git add --force", _log_file+"'? (Yn)")
-        inp = "Y"
-        if assume_yes:
-            print(inp)
-        else:
-            inp = input()
-        if inp != "n":
+        if ask("Add .env to .gitignore?", assume_yes):
             if dummy:
-                print("-dummy-", "not running `git add --force", _log_fle + "`")
+                print("-dummy-", "not adding .env to .gitignore")
             else:
-                os.system("git add --force " + _log_file)
+                with open(".gitignore", "a+") as file:
+                    file.seek(0)
+                    content = file.read()
+                    file.write(("\n" if len(content) > 0 and not content.endswith("\n") else "") + ".env\n")
+                if ".gitignore" not in paths:
+                    paths.append(".gitignore")
+    tracked = repo.tracked()
+    paths += [path for path in block.get("scanned", []) if path not in tracked]
+    # modified (and deleted) tracked files, also those changed before a run that did not commit them
+    paths += repo.modified()
+    paths = list(dict.fromkeys(paths))
+    # the walker only knows .gitignore files, git also excludes via .git/info/exclude and core.excludesFile
+    excluded = repo.ignored([path for path in paths if path not in tracked])
+    paths = [path for path in paths if path not in excluded]
+    if _log_file not in tracked and _log_file in ignored:
+        print(_log_file, "is ignored by git")
+        if ask("Add it anyway (like 'git add --force " + _log_file + "')?", assume_yes):
+            paths.append(_log_file)
+    elif _log_file not in paths:
+        paths.append(_log_file)
     print("Git submission:")
     if not assume_yes:
-        os.system("git add -n .")
-        print("Proceed? (Yn)")
-        if input() == "n":
+        for path in paths:
+            print(" ", path)
+        if not ask("Proceed?", assume_yes):
             print("Aborting...")
-            return
-    if dummy:
-        print("-dummy-", "not running `git add .`")
-    else:
-        os.system("git add .")
-    if not assume_yes:
-        os.system("git status")
-        print("Proceed? (Yn)")
-        if input() == "n":
+            return None
+    repo.stage(paths)
+    if not assume_yes and not dummy:
+        print(repo.staged_summary())
+        if not ask("Proceed?", assume_yes):
             print("Aborting...")
-            return
-    if dummy:
-        print("-dummy-", "not running `git commit -a -m 'timestampblocks update for root " + block["root"] + "'`")
-        print("-dummy-", "not running `git push`")
-    else:
-        os.system("git commit -a -m 'timestampblocks update for root " + block["root"] + "'")
-        os.system("git push")
+            return None
+    commit = repo.commit("timestampblocks update for root " + block["root"])
+    if commit is None and not dummy:
+        print("nothing to commit")
+        return None
+    if section.get("push", "yes") != "no":
+        repo.push(section.get("remote"), section.get("branch"))
+    return commit
 
-def publish_shell(block, assume_yes, dummy=False):
+def publish_shell(block, assume_yes, dummy=False, channel="shell", settings=None):
     print("New block with root '"+ block["root"]+"', and data:")
     print(block["data"])
     print("Used hashing algorithm:", block["hashing"])
     print("Timestamp:", block["timestamp"], "--", datetime.fromtimestamp(block["timestamp"]))
 
 def build_block(new_hashes, last_root, last_proper_root, hashing):
-    timestamp = int(time.time())
-    line_builder = [str(timestamp)]
+    with instrument.phase("build"):
+        return _build_block(new_hashes, last_root, last_proper_root, hashing)
+
+def _build_block(new_hashes, last_root, last_proper_root, hashing):
+    builder = stream.BlockBuilder(hashing, last_root, last_proper_root)
+    builder.update(new_hashes)
+    return builder.finish()
+
+def split_block_line(line):
+    # v2 data line into header (timestamp and previous roots) and file digests
+    tokens = line.split()
+    index = tokens.index(_leaf_separator)
+    return " ".join(tokens[:index]), tokens[index+1:]
+
+def block_root(line, hashing, log_version):
+    # v1: hash of the data line
+    # v2: hash of the header and the merkle root over the file digests
+    algo = hashlib.new(merkle.base_hashing(hashing))
+    if log_version < 2:
+        algo.update(line.encode("utf-8"))
+    else:
+        (header, leaves) = split_block_line(line)
+        merkle_root = merkle.merkle_root([bytes.fromhex(leaf) for leaf in leaves], hashing)
+        algo.update((header + " " + merkle_root.hex()).encode("utf-8"))
+    return algo.hexdigest()
+
+def iter_blocks(hashing=None):
+    # yields (log_version, hashing, data line, root) for every block of the log
+    log_version = 0
+    current_hashing = ""
+    previous_line = ""
+    if not Path(_log_file).exists():
+        return
+    with open(_log_file, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\r\n")
+            if len(line) == 0:
+                continue
+            if line.startswith("#timehashblock v"):
+                log_version = int(line[16:])
+            elif line.startswith("#hashing "):
+                current_hashing = line[9:]
+            elif line.startswith("#root "):
+                if hashing is None or hashing == current_hashing:
+                    yield (log_version, current_hashing, previous_line, line[6:])
+            elif line[0] != "#":
+                previous_line = line
+
+def _check_roots(records):
+    # records: list of (line number, log_version, hashing, data line, root)
+    results = []
+    for (line_number, log_version, hashing, line, root) in records:
+        try:
+            computed = block_root(line, hashing, log_version)
+        except (ValueError, TypeError) as e:
+            computed = "unreadable (" + type(e).__name__ + ")"
+        results.append((line_number, hashing, root, computed))
+    return results
+
+def _hash_tree(hashings, jobs, blocksize, results):
+    # producer for `verify`: puts lists of (path, digests) on the queue, None when done
+    try:
+        filenames = [filename for (filename, entry) in walker.walk(".", ".gitignore", _state_ignore_lines)]
+        for i in range(0, len(filenames), _verify_files_chunk):
+            chunk = filenames[i:i+_verify_files_chunk]
+            results.put(list(zip(chunk, hashengine.hash_files(chunk, tuple(hashings), jobs, None, blocksize))))
+    finally:
+        results.put(None)
+
+def verify(settings, jobs=None, blocksize=_blocksize):
+    # audit of the whole log (every root and every link, not only the first
+    # problem) and of the current tree against it; roots are checked in a
+    # process pool while a thread hashes the tree, results are printed as they
+    # come in, returns False if anything in the log is broken
+    hashings = get_hashings(settings)
+    known = {hashing: knownhashes.KnownHashes(hashing) for hashing in hashings}
+    files = queue.Queue(maxsize=16)
+    hasher = threading.Thread(target=_hash_tree, args=(hashings, jobs, blocksize, files), daemon=True)
+    hasher.start()
+    broken_roots = 0
+    broken_links = 0
+    blocks = 0
+    pending = [] #list of (records, future), oldest first
+    records = []
+    def report(done, future):
+        nonlocal broken_roots
+        try:
+            results = future.result()
+        except BrokenProcessPool:
+            #no process support here, check in this thread
+            results = _check_roots(done)
+        for (line_number, hashing, root, computed) in results:
+            if computed != root:
+                broken_roots += 1
+                print("BROKEN root", "line", line_number, "(" + hashing + "):", root, "computed", computed)
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        log_version = 0
+        hashing = ""
+        previous_line = None
+        last_root = ""
+        roots = {}
+        if Path(_log_file).exists():
+            with open(_log_file, "r", encoding="utf-8") as f:
+                for (line_number, line) in enumerate(f, 1):
+                    line = line.rstrip("\r\n")
+                    if len(line) == 0:
+                        continue
+                    if line.startswith("#timehashblock v"):
+                        log_version = int(line[16:])
+                    elif line.startswith("#hashing "):
+                        hashing = line[9:]
+                    elif line.startswith("#root "):
+                        root = line[6:]
+                        blocks += 1
+                        if previous_line is None:
+                            broken_links += 1
+                            print("BROKEN link", "line", line_number, "root without data line")
+                            continue
+                        (data_line_number, data) = previous_line
+                        if not verify_link(data, log_version, last_root, roots.get(hashing, "")):
+                            broken_links += 1
+                            print("BROKEN link", "line", data_line_number, "(" + hashing + "):",
+                                  "does not continue from", last_root or "the start")
+                        records.append((data_line_number, log_version, hashing, data, root))
+                        if len(records) >= _verify_chunk:
+                            pending.append((records, pool.submit(_check_roots, records)))
+                            records = []
+                        while len(pending) > 4 * (jobs or os.cpu_count() or 1) or (
+                                len(pending) > 0 and pending[0][1].done()):
+                            report(*pending.pop(0))
+                        last_root = root
+                        roots[hashing] = root
+                        previous_line = None
+                    elif line[0] != "#" and len(hashing) > 0:
+                        previous_line = (line_number, line)
+                        if hashing in known:
+                            tokens = line.split()
+                            if log_version >= 2 and _leaf_separator in tokens:
+                                tokens = tokens[tokens.index(_leaf_separator)+1:]
+                            known[hashing].update(tokens)
+        if len(records) > 0:
+            pending.append((records, pool.submit(_check_roots, records)))
+        for (done, future) in pending:
+            report(done, future)
+    if previous_line is not None:
+        print("data line", previous_line[0], "has no root yet")
+    print("log:", blocks, "blocks,", broken_roots, "broken root(s),", broken_links, "broken link(s)")
+    covered = 0
+    uncovered = 0
+    while True:
+        chunk = files.get()
+        if chunk is None:
+            break
+        for (path, digests) in chunk:
+            if digests is None:
+                uncovered += 1
+                print("unreadable", path)
+            elif any(digest in known[hashing] for (hashing, digest) in zip(hashings, digests)):
+                covered += 1
+                print("covered  ", path)
+            else:
+                uncovered += 1
+                print("uncovered", path)
+    print("tree:", covered + uncovered, "files,", covered, "covered by a block,", uncovered, "not covered yet")
+    return broken_roots == 0 and broken_links == 0
+
+def verify_link(line, log_version, last_root, last_proper_root):
+    # v2 headers are exact: timestamp, [previous root of this hashing], [previous root]
+    # v1 lines only have to mention the previous root somewhere
+    tokens = line.split()
+    if log_version < 2:
+        return len(last_root) == 0 or last_root in tokens
+    if _leaf_separator not in tokens:
+        return False
+    header = tokens[:tokens.index(_leaf_separator)]
+    expected = []
     if len(last_proper_root) > 0 and last_root != last_proper_root:
-        line_builder.append(last_proper_root)
+        expected.append(last_proper_root)
     if len(last_root) > 0:
-        line_builder.append(last_root)
-    line_builder.extend(new_hashes)
-    line = " ".join(line_builder)
-    algo = hashlib.new(hashing)
-    algo.update(line.encode("utf-8"))
-    block = {
-        "root": algo.hexdigest(),
-        "data": line,
-        "timestamp": timestamp,
-        "hashed_files": new_hashes,
-        "hashing": hashing
-    }
-    return block
-
-def get_new_hashes(hash_set, hashing):
-    files = Path().glob("**/*")
-    lines = []
-    if Path(".gitignore").exists():
-        lines = Path(".gitignore").read_text().splitlines()
-    lines = lines + [_log_file]
-    spec = pathspec.PathSpec.from_lines("gitwildmatch", lines)
-    files = [
-        file for file in files if not spec.match_file(str(file))
-    ]
-    new_hashes = set()
-    for file in files:
-        if file.is_dir():
+        expected.append(last_root)
+    return header[1:] == expected
+
+def prove(path, hashing, blocksize=_blocksize, offset=None, jobs=None):
+    # inclusion proof for the first block containing the digest of path
+    # offset (tree hashings only): also prove the chunk holding that byte
+    if offset is not None and not treehash.is_tree(hashing):
+        raise ValueError("byte ranges can only be proven with a tree hashing, not " + hashing)
+    digest = hashengine.hash_files([path], hashing, jobs, None, blocksize)[0]
+    assert digest is not None, "could not read " + path
+    proof = None
+    for (log_version, block_hashing, line, root) in iter_blocks(hashing):
+        if log_version < 2:
+            if digest in line.split():
+                # no tree in v1 blocks, the whole line is the proof
+                proof = {
+                    "version": log_version,
+                    "hashing": hashing,
+                    "file": path,
+                    "digest": digest,
+                    "data": line,
+                    "root": root,
+                }
+                break
+        else:
+            (header, leaves) = split_block_line(line)
+            if digest in leaves:
+                raw_leaves = [bytes.fromhex(leaf) for leaf in leaves]
+                proof = {
+                    "version": log_version,
+                    "hashing": hashing,
+                    "file": path,
+                    "digest": digest,
+                    "header": header,
+                    "proof": merkle.merkle_proof(raw_leaves, leaves.index(digest), hashing),
+                    "root": root,
+                }
+                break
+    if proof is not None:
+        proof["anchors"] = list(iter_anchors(proof["root"]))
+        if offset is not None:
+            proof["chunk"] = treehash.chunk_proof(path, hashing, offset, jobs)
+    return proof
+
+def verify_proof(proof, blocksize=_blocksize):
+    hashing = proof["hashing"]
+    algo = hashlib.new(merkle.base_hashing(hashing))
+    if proof["version"] < 2:
+        ok = proof["digest"] in proof["data"].split()
+        algo.update(proof["data"].encode("utf-8"))
+        timestamp = None
+    else:
+        merkle_root = merkle.root_from_proof(bytes.fromhex(proof["digest"]), proof["proof"], hashing)
+        algo.update((proof["header"] + " " + merkle_root.hex()).encode("utf-8"))
+        ok = True
+        timestamp = int(proof["header"].split()[0])
+    ok = ok and algo.hexdigest() == proof["root"]
+    if not ok:
+        print("proof is invalid for root", proof["root"])
+        return False
+    print("proof ok:", proof["digest"], "is part of block", proof["root"])
+    if timestamp is not None:
+        print("Timestamp:", timestamp, "--", datetime.fromtimestamp(timestamp))
+    if "chunk" in proof:
+        chunk = proof["chunk"]
+        if not treehash.verify_chunk(chunk, proof["digest"], hashing):
+            print("chunk proof is invalid for digest", proof["digest"])
+            return False
+        print("chunk", chunk["chunk"], "(bytes", chunk["offset"], "to", str(chunk["offset"] + chunk["length"]) + ")",
+              "is part of", proof["digest"])
+        if Path(proof["file"]).is_file():
+            with open(proof["file"], "rb") as f:
+                f.seek(chunk["offset"])
+                data = f.read(chunk["length"])
+            if treehash.verify_chunk(chunk, proof["digest"], hashing, data):
+                print("local bytes of", proof["file"], "match the chunk")
+            else:
+                print("local bytes of", proof["file"], "do not match the chunk (anymore)")
+    if Path(proof["file"]).is_file():
+        if hashengine.hash_file(proof["file"], hashing, blocksize) == proof["digest"]:
+            print("local file", proof["file"], "matches the digest")
+        else:
+            print("local file", proof["file"], "does not match the digest (anymore)")
+    if any(root == proof["root"] for (log_version, block_hashing, line, root) in iter_blocks(hashing)):
+        print("root found in", _log_file)
+    for (aggregate_root, aggregate_hashing, proof_text) in proof.get("anchors", []):
+        if anchoring.verify_anchor(proof["root"], aggregate_root, proof_text, aggregate_hashing):
+            print("anchored via aggregate root", aggregate_root)
+        else:
+            print("invalid anchor for aggregate root", aggregate_root)
+    return True
+
+def iter_anchors(block_root):
+    # yields (aggregate root, hashing, proof) of every `#anchor` line for block_root
+    if not Path(_log_file).exists():
+        return
+    aggregate_hashing = ""
+    with open(_log_file, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("#aggregate "):
+                aggregate_hashing = line.split()[2]
+            elif line.startswith("#anchor "):
+                tokens = line.split()
+                if tokens[1] == block_root:
+                    yield (tokens[2], aggregate_hashing, tokens[3])
+
+def lookup(settings, target, blocksize=_blocksize, jobs=None):
+    # first block holding the digest of the file `target` (or `target` itself as digest), via the digest index
+    # read-only: the index covers the log up to the checkpoint, blocks after it are searched directly,
+    # only without a usable checkpoint the log is replayed (which writes the checkpoint)
+    checkpoint = logcheckpoint.LogCheckpoint(_log_checkpoint_file, _known_hashes_prefix, _digest_index_prefix)
+    if not checkpoint.load() or not checkpoint.matches(_log_file, fingerprint=False):
+        evaluate_previous_logs(settings)
+        checkpoint = logcheckpoint.LogCheckpoint(_log_checkpoint_file, _known_hashes_prefix, _digest_index_prefix)
+        checkpoint.load()
+    hashings = get_hashings(settings)
+    if os.path.isfile(target):
+        digests = hashengine.hash_files([target], tuple(hashings), jobs, None, blocksize)[0]
+        assert digests is not None, "could not read " + target
+        candidates = list(zip(hashings, digests))
+    else:
+        assert len(target) % 2 == 0 and all(c in "0123456789abcdefABCDEF" for c in target), \
+            target + " is neither a file nor a hex digest"
+        candidates = [(hashing, target.lower()) for hashing in dict.fromkeys(hashings + list(checkpoint.indexes))
+                      if 2 * checkpoint.read_index(hashing).digest_size == len(target)]
+    found = False
+    for (hashing, digest) in candidates:
+        offset = checkpoint.read_index(hashing).lookup(digest)
+        if offset is None:
+            offset = search_log_tail(checkpoint, hashing, digest)
+        if offset is None:
+            print(hashing, digest, "is not in any block")
             continue
-        filename = str(file)
-        algo = hashlib.new(hashing)
-        try:
-            with open(file, 'rb') as f:
-                fb = f.read(_blocksize)
-                while len(fb) > 0:
-                    algo.update(fb)
-                    fb = f.read(_blocksize)
-        except:
-            pass
-        hash_value = algo.hexdigest()
-        if hash_value not in hash_set:
-            new_hashes.add(hash_value)
-    return list(new_hashes)
+        (timestamp, root) = read_block_at(offset)
+        print(hashing, digest, "is part of block", root)
+        if timestamp is not None:
+            print("Timestamp:", timestamp, "--", datetime.fromtimestamp(timestamp))
+        print("log offset:", offset)
+        found = True
+    return found
+
+def search_log_tail(checkpoint, hashing, digest):
+    # log offset of the first block after the checkpoint whose data line holds digest, or None
+    log_version = checkpoint.log_version
+    log_hashing = checkpoint.hashing
+    offset = checkpoint.offset
+    found = None #offset of the current data line if it holds digest
+    with open(_log_file, "rb") as f:
+        f.seek(offset)
+        for raw_line in f:
+            line_offset = offset
+            offset += len(raw_line)
+            line = raw_line.decode("utf-8").rstrip("\r\n")
+            if len(line) == 0:
+                continue
+            if line.startswith("#timehashblock v"):
+                log_version = int(line[16:])
+            elif line.startswith("#hashing "):
+                log_hashing = line[9:]
+            elif line.startswith("#root "):
+                if found is not None:
+                    return found
+            elif line[0] != "#" and log_hashing == hashing:
+                leaves = split_block_line(line)[1] if log_version >= 2 else line.split()
+                found = line_offset if digest in leaves else None
+    return None
+
+def read_block_at(offset):
+    # (timestamp, root) of the block whose data line starts at byte `offset` of the log,
+    # blocks can be long, so the line is never read as a whole
+    marker = b"\n#root "
+    with open(_log_file, "rb") as f:
+        f.seek(offset)
+        # v2 lines start with the timestamp, v1 lines may have a previous root (or 0) in front of it
+        timestamp = None
+        for token in f.read(_lookup_header).split()[:3]:
+            if token.isdigit() and len(token) <= 12 and int(token) > 0:
+                timestamp = int(token)
+                break
+        f.seek(offset)
+        position = offset
+        tail = b""
+        while True:
+            data = tail + f.read(_lookup_read)
+            index = data.find(marker)
+            if index >= 0:
+                f.seek(position - len(tail) + index + len(marker))
+                return timestamp, f.readline().decode("utf-8").strip()
+            if len(data) == len(tail):
+                return timestamp, None
+            position += len(data) - len(tail)
+            tail = data[-len(marker):]
+
+def get_blocksize(settings):
+    blocksize = settings["default"].get("blocksize", "auto")
+    if blocksize == "auto":
+        return _blocksize
+    return int(blocksize)
+
+def get_new_hashes(hash_sets, hashings, cache=None, jobs=None, blocksize=_blocksize, changed=None, scanned=None):
+    # every file is read once for all algorithms, returns dict with key=hashing, value=list of new digests
+    # changed: optional list, gets the paths of files with a new digest or whose digest was not
+    #   cached, i.e. possibly changed content (for the git channel)
+    # scanned: optional list, gets every path of the scan
+    # dicts keep the (walk) order of first appearance
+    new_hashes = {hashing: {} for hashing in hashings}
+    for (filename, file_digests) in stream.iter_file_digests(".", ".gitignore", tuple(hashings), _state_ignore_lines,
+                                                             cache, jobs, blocksize):
+        if file_digests is None:
+            print("could not read", filename, "- skipped")
+            continue
+        is_new = False
+        for (hashing, digest) in zip(hashings, file_digests):
+            if digest not in hash_sets[hashing]:
+                new_hashes[hashing][digest] = None
+                is_new = True
+        if changed is not None and (is_new or cache is None or not cache.enabled or filename in cache.stored):
+            changed.append(filename)
+        if scanned is not None:
+            scanned.append(filename)
+    return {hashing: list(new_hashes[hashing]) for hashing in hashings}
 
 def evaluate_previous_logs(settings):
-    log_version=0
-    hash_set = set()
-    hashing = ""
-    last_root = ""
-    last_hashing_root = ""
+    with instrument.phase("replay"):
+        return _evaluate_previous_logs(settings)
+
+def _evaluate_previous_logs(settings):
+    # only lines appended after the last checkpoint are parsed and verified
+    checkpoint = logcheckpoint.LogCheckpoint(_log_checkpoint_file, _known_hashes_prefix, _digest_index_prefix)
+    if not checkpoint.load() or not checkpoint.matches(_log_file):
+        checkpoint.reset()
+    log_version = checkpoint.log_version
+    hashing = checkpoint.hashing
+    last_root = checkpoint.last_root
+    roots = dict(checkpoint.roots)
     previous_line = ""
+    previous_offset = 0 #log offset of previous_line
+    tokens = {} #tokens of data lines since the last root, per hashing
     if Path(_log_file).exists():
-        lines = Path(_log_file).read_text().splitlines()
-        for line in lines:
-            if line[0] == "#":
-                if line.startswith("#timehashblock v"):
-                    log_version=int(line[16:])
-                elif line.startswith("#hashing "):
-                    hashing = line[9:]
-                elif line.startswith("#root "):
-                    last_root = line[6:]
-                    if hashing == settings["default"]["hashing"]:
-                        last_hashing_root = last_root
-                    algo = hashlib.new(hashing)
-                    algo.update(previous_line.encode("utf-8"))
-                    assert last_root == algo.hexdigest()
-            else:
-                previous_line = line
-                if hashing == settings["default"]["hashing"]:
-                    hash_set.update(line.split())
+        with open(_log_file, "rb") as f:
+            offset = checkpoint.offset
+            start_offset = offset
+            f.seek(offset)
+            for raw_line in f:
+                line_offset = offset
+                offset += len(raw_line)
+                line = raw_line.decode("utf-8").rstrip("\r\n")
+                if len(line) == 0:
+                    continue
+                if line[0] == "#":
+                    if line.startswith("#timehashblock v"):
+                        log_version=int(line[16:])
+                    elif line.startswith("#hashing "):
+                        hashing = line[9:]
+                    elif line.startswith("#root "):
+                        last_root = line[6:]
+                        roots[hashing] = last_root
+                        assert last_root == block_root(previous_line, hashing, log_version)
+                        if instrument.enabled:
+                            instrument.count("blocks_verified")
+                        if log_version >= 2:
+                            leaves = split_block_line(previous_line)[1]
+                        else:
+                            leaves = previous_line.split()
+                        checkpoint.advance(offset, log_version, hashing, last_root, roots, tokens,
+                                           previous_offset, leaves)
+                        tokens = {}
+                elif len(hashing) > 0:
+                    previous_line = line
+                    previous_offset = line_offset
+                    tokens.setdefault(hashing, []).extend(line.split())
+        checkpoint.save(_log_file)
+        instrument.count("log_bytes_replayed", offset - start_offset)
+    # data lines after the last root still count, but do not go into the checkpoint
+    hash_sets = {}
+    for setting in get_hashings(settings):
+        hash_sets[setting] = checkpoint.read_known(setting)
+        hash_sets[setting].update(tokens.get(setting, []))
+    return hash_sets, last_root, roots, hashing, log_version
+
+def upgrade_log_version(log_version, dummy):
+    # new blocks are always written in the current format, so the log has to say so before them
+    assert log_version <= _log_version, "existing log is more advanced than this program"
     if log_version != _log_version:
-        assert log_version < _log_version, "existing log is more advanced than this program"
+        if dummy:
+            print("-dummy-", "not marking", _log_file, "as v" + str(_log_version))
+            return
         with open(_log_file, 'a') as file:
             file.write("#timehashblock v"+str(_log_version)+"\n")
-    return hash_set, last_root, last_hashing_root
 
 def query_configuration(settings):
     print("Adjusting Configuration")
     print("-----------------------")
     print("Default publish channels:")
-    print(" - available: " + str(_possible_publish))
+    print(" - available: " + str(channels.names(plugins=True)))
     print(" - currently: '" + settings["default"]["publish"]+"'")
     inp = input()
     if len(inp) > 0:
         settings["default"]["publish"] = inp
-    channels = set(settings["default"]["publish"].split())
-    if "iota" in channels:
+    selected = set(settings["default"]["publish"].split())
+    if "iota" in selected:
         if not settings.has_section("iota"):
             settings["iota"] = _config["iota"]
         print("------- iota")
         settings["iota"] = query_protocol("iota", settings["iota"])
-    if "evm" in channels:
+    if "evm" in selected:
         if not settings.has_section("evm"):
             settings["evm"] = _config["evm"]
         print("------- evm")
         settings["evm"] = query_protocol("evm", settings["evm"])
-    for channel in channels:
-        if not channel in _possible_publish:
+    for channel in selected:
+        if not channel in channels.names():
             if not settings.has_section(channel):
                 protocol = "evm"
             else:
@@ -371,7 +1091,7 @@ def query_configuration(settings):
             if len(inp) > 0:
                 new_protocol = inp
             if not settings.has_section(channel) or protocol != new_protocol:
-                settings[channel] = _config[new_protocol]
+                settings[channel] = _config.get(new_protocol, {"protocol": new_protocol})
             settings[channel] = query_protocol(channel, settings[channel])
     print("-----------------------")
     print("Default hash algorithm:")
@@ -402,5 +1122,10 @@ def query_protocol(channel, default_dic, skip_list = ["protocol"]):
                     _dotenv = dotenv_values(".env")
     return dd
 
+channels.register("shell", publish_shell)
+channels.register("git", publish_git)
+channels.register("iota", publish_iota)
+channels.register("evm", publish_evm)
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,68 @@
+import importlib
+
+# publisher registry
+#
+# A publisher is a function `publish(block, assume_yes, dummy, channel, settings)`
+# returning whatever identifies the publication (transaction id, block id) or
+# None. `settings` is the ConfigParser, the channel's own section (if any) is
+# `settings[channel]`. Channels without a section use their name as protocol.
+#
+# Built-in publishers are registered by capture.py, either as function or as
+# "module:function" text which is imported on first use only. Other packages
+# add protocols through the entry point group below, e.g. in pyproject.toml:
+# | [project.entry-points."timestampblocks.channels"]
+# | nostr = "tsb_nostr:publish"
+# Entry points are only looked up for protocols that are not registered.
+
+_entry_point_group = "timestampblocks.channels"
+_registry = {} #dict with key=protocol, value=publish function or "module:function"
+_entry_points = None #dict with key=protocol, value=EntryPoint, filled on first lookup
+
+def register(protocol, target):
+    _registry[protocol] = target
+
+def _load(target):
+    if callable(target):
+        return target
+    (module_name, function_name) = target.split(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+def entry_points():
+    global _entry_points
+    if _entry_points is None:
+        _entry_points = {}
+        try:
+            from importlib.metadata import entry_points as find_entry_points
+        except ImportError:
+            #python < 3.8
+            return _entry_points
+        found = find_entry_points()
+        if hasattr(found, "select"):
+            found = found.select(group=_entry_point_group)
+        else:
+            found = found.get(_entry_point_group, ())
+        for entry_point in found:
+            _entry_points[entry_point.name] = entry_point
+    return _entry_points
+
+def names(plugins=False):
+    # registered protocols, plugins=True includes installed entry points (slower)
+    found = list(_registry)
+    if plugins:
+        found += [name for name in entry_points() if name not in _registry]
+    return tuple(found)
+
+def protocol_of(channel, settings):
+    if settings.has_section(channel) and "protocol" in settings[channel]:
+        return settings[channel]["protocol"]
+    return channel
+
+def get(protocol):
+    # publish function for protocol, None if nothing provides it
+    if protocol not in _registry:
+        entry_point = entry_points().get(protocol)
+        if entry_point is None:
+            return None
+        _registry[protocol] = entry_point.load()
+    _registry[protocol] = _load(_registry[protocol])
+    return _registry[protocol]
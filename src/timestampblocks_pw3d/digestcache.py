@@ -0,0 +1,107 @@
+import os
+import time
+
+# persistent digest cache, one entry per (path, hashing) pair
+#
+# cache file format:
+# | #digestcache v1 <started_ns>
+# | hashing size mtime_ns inode digest path
+# | hashing size mtime_ns inode digest path
+# more lines
+#
+# `started_ns` is the time the writing run started, i.e. before any of its
+# files were read. Similar to racy-git, an entry is only trusted if the file
+# was last modified well before that moment, otherwise a change within the
+# same mtime granularity could go unnoticed and the file gets hashed again.
+
+_cache_version = 1
+_racy_ns = 2 * 10**9 # covers coarse (e.g. FAT) mtime resolution
+
+class DigestCache:
+    cachefile = None
+    enabled = True
+    entries = None #dict with key=(path, hashing), value=(size, mtime_ns, inode, digest)
+    seen = None #set of paths looked up or stored during this run
+    stored = None #set of paths hashed (not served from the cache) during this run
+    loaded_ns = 0
+    started_ns = 0
+    hits = 0
+    misses = 0
+
+    def __init__(self, cachefile, enabled=True, rehash=False):
+        # enabled=False: neither read nor write the cache (--no-cache)
+        # rehash=True: ignore existing entries but write a fresh cache (--rehash)
+        self.cachefile = cachefile
+        self.enabled = enabled
+        self.entries = {}
+        self.seen = set()
+        self.stored = set()
+        self.started_ns = time.time_ns()
+        if enabled and not rehash:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.cachefile, "r", encoding="utf-8") as f:
+                header = f.readline().split()
+                if len(header) != 3 or header[0] != "#digestcache" or header[1] != "v"+str(_cache_version):
+                    return
+                self.loaded_ns = int(header[2])
+                for line in f:
+                    try:
+                        (hashing, size, mtime_ns, inode, digest, path) = line.rstrip("\n").split(" ", 5)
+                        self.entries[(path, hashing)] = (int(size), int(mtime_ns), int(inode), digest)
+                    except ValueError:
+                        #broken line, simply forget about it
+                        pass
+        except (OSError, UnicodeDecodeError):
+            self.entries = {}
+
+    def lookup(self, path, st, hashing):
+        # returns the cached digest if `st` (an os.stat_result) still matches, None otherwise
+        if not self.enabled or st is None:
+            return None
+        self.seen.add(path)
+        entry = self.entries.get((path, hashing))
+        if entry is not None:
+            (size, mtime_ns, inode, digest) = entry
+            if (size == st.st_size and mtime_ns == st.st_mtime_ns and inode == st.st_ino
+                    and mtime_ns + _racy_ns <= self.loaded_ns):
+                self.hits += 1
+                return digest
+        self.misses += 1
+        return None
+
+    def store(self, path, st, hashing, digest):
+        # `st` has to be taken before reading the file
+        if not self.enabled or st is None or "\n" in path:
+            return
+        self.seen.add(path)
+        self.stored.add(path)
+        self.entries[(path, hashing)] = (st.st_size, st.st_mtime_ns, st.st_ino, digest)
+
+    def save(self):
+        # only entries of paths visited during this run survive, this drops deleted files
+        if not self.enabled:
+            return
+        tmpfile = self.cachefile + ".tmp"
+        with open(tmpfile, "w", encoding="utf-8") as f:
+            f.write("#digestcache v"+str(_cache_version)+" "+str(self.started_ns)+"\n")
+            for (path, hashing) in self.entries:
+                if path in self.seen:
+                    (size, mtime_ns, inode, digest) = self.entries[(path, hashing)]
+                    f.write(" ".join([hashing, str(size), str(mtime_ns), str(inode), digest, path])+"\n")
+        os.replace(tmpfile, self.cachefile)
+
+def stat_file(path):
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+def stat_entry(entry):
+    # reuses the stat information os.scandir already has where possible
+    try:
+        return entry.stat()
+    except OSError:
+        return None
@@ -0,0 +1,173 @@
+import os
+import mmap
+import heapq
+import hashlib
+import merkle
+
+# persistent digest -> block index of one hashing algorithm, for `lookup`
+#
+# The index is a list of segment files `<prefix><hashing>-<generation>`,
+# each a sorted array of fixed size records: raw digest + the log offset of
+# the data line of the first block holding that digest (8 bytes, big
+# endian, so records sort by digest, then offset). A lookup memory-maps the
+# segments and bisects each one, root and timestamp are read from the log at
+# that offset.
+# New digests collect in memory and go into a new segment on `flush`, which
+# then merges it with its predecessors while they are less than
+# `_merge_ratio` times its size. That keeps the number of segments
+# logarithmic and every record gets rewritten a logarithmic number of times.
+# Merged-away segments stay on disk until `remove_obsolete`, i.e. until the
+# log checkpoint no longer names them.
+
+_offset_size = 8
+_merge_ratio = 2
+_flush_threshold = 1048576 #pending digests that are written as segment right away
+_read_records = 65536 #records per read while merging
+
+class DigestIndex:
+    prefix = None
+    hashing = None
+    digest_size = 0
+    record_size = 0
+    segments = None #list of (generation, size in bytes), oldest first
+    pending = None #dict with key=raw digest, value=log offset
+    obsolete = None #list of segment files to remove after the checkpoint is saved
+
+    def __init__(self, prefix, hashing, segments=()):
+        self.prefix = prefix
+        self.hashing = hashing
+        self.digest_size = hashlib.new(merkle.base_hashing(hashing)).digest_size
+        self.record_size = self.digest_size + _offset_size
+        self.segments = list(segments)
+        self.pending = {}
+        self.obsolete = []
+
+    def filename(self, generation):
+        return self.prefix + self.hashing + "-" + str(generation)
+
+    def files(self):
+        return [self.filename(generation) for (generation, size) in self.segments]
+
+    def state(self):
+        # checkpoint value, e.g. "3:4096 5:112"
+        return " ".join(str(generation) + ":" + str(size) for (generation, size) in self.segments)
+
+    def matches(self):
+        try:
+            return all(os.path.getsize(self.filename(generation)) == size for (generation, size) in self.segments)
+        except OSError:
+            return False
+
+    def add(self, hex_value, offset):
+        # the first block wins, so callers go through the log from the start
+        if len(hex_value) != 2 * self.digest_size:
+            return
+        try:
+            raw = bytes.fromhex(hex_value)
+        except ValueError:
+            return
+        if raw not in self.pending:
+            self.pending[raw] = offset
+            if len(self.pending) >= _flush_threshold:
+                self.flush()
+
+    def update(self, hex_values, offset):
+        for hex_value in hex_values:
+            self.add(hex_value, offset)
+
+    def _records(self, filename):
+        with open(filename, "rb") as f:
+            while True:
+                data = f.read(self.record_size * _read_records)
+                if len(data) == 0:
+                    return
+                for start in range(0, len(data), self.record_size):
+                    yield data[start:start+self.record_size]
+
+    def _write(self, generation, records):
+        # unique by digest, the smallest offset stays
+        filename = self.filename(generation)
+        size = 0
+        last = None
+        parts = []
+        with open(filename + ".tmp", "wb") as f:
+            for record in records:
+                if record[:self.digest_size] == last:
+                    continue
+                last = record[:self.digest_size]
+                parts.append(record)
+                if len(parts) >= _read_records:
+                    size += f.write(b"".join(parts))
+                    parts = []
+            size += f.write(b"".join(parts))
+        os.replace(filename + ".tmp", filename)
+        return (generation, size)
+
+    def flush(self):
+        if len(self.pending) == 0:
+            return
+        generation = max([generation for (generation, size) in self.segments], default=0) + 1
+        self.segments.append(self._write(generation, (
+            raw + self.pending[raw].to_bytes(_offset_size, "big") for raw in sorted(self.pending)
+        )))
+        self.pending = {}
+        while len(self.segments) > 1 and self.segments[-2][1] < _merge_ratio * self.segments[-1][1]:
+            self._merge_last()
+
+    def _merge_last(self):
+        older = self.segments[-2]
+        newer = self.segments[-1]
+        merged = self._write(newer[0] + 1, heapq.merge(
+            self._records(self.filename(older[0])), self._records(self.filename(newer[0]))
+        ))
+        self.segments[-2:] = [merged]
+        self.obsolete += [self.filename(older[0]), self.filename(newer[0])]
+
+    def remove_obsolete(self):
+        current = set(self.files())
+        for filename in self.obsolete:
+            if filename not in current and os.path.exists(filename):
+                os.remove(filename)
+        self.obsolete = []
+
+    def remove(self):
+        for filename in self.files() + self.obsolete:
+            if os.path.exists(filename):
+                os.remove(filename)
+        self.segments = []
+        self.pending = {}
+        self.obsolete = []
+
+    def _search(self, view, raw):
+        # log offset of raw in one segment, or None
+        low = 0
+        high = len(view) // self.record_size
+        while low < high:
+            middle = (low + high) // 2
+            start = middle * self.record_size
+            if view[start:start+self.digest_size] < raw:
+                low = middle + 1
+            else:
+                high = middle
+        start = low * self.record_size
+        if start < len(view) and view[start:start+self.digest_size] == raw:
+            return int.from_bytes(view[start+self.digest_size:start+self.record_size], "big")
+        return None
+
+    def lookup(self, hex_value):
+        # log offset of the first block holding the digest, or None
+        if len(hex_value) != 2 * self.digest_size:
+            return None
+        raw = bytes.fromhex(hex_value)
+        found = []
+        if raw in self.pending:
+            found.append(self.pending[raw])
+        for (generation, size) in self.segments:
+            if size == 0:
+                continue
+            with open(self.filename(generation), "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    offset = self._search(mm, raw)
+            if offset is not None:
+                found.append(offset)
+        return min(found, default=None)
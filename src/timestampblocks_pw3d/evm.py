@@ -0,0 +1,126 @@
+import time
+import threading
+
+# reusable EVM publisher
+#
+# One publisher per (node, account) lives for the whole process: the HTTP
+# session is pooled, the nonce is fetched once and then counted locally (so
+# several publishes can be in flight without waiting for each other to be
+# mined), the gas price is cached for `gas_price_ttl` seconds and the gas
+# limit is estimated instead of sending a fixed cap.
+#
+# A block's transaction is signed once and kept until the node accepted it.
+# Retries resend the very same bytes, so a request that timed out after
+# reaching the node cannot publish (and pay for) the root twice. Only a
+# transaction the node rejected is signed again, with a fresh nonce.
+
+_gas_price_ttl = 30.0
+_gas_margin = 1.2
+_publishers = {} #dict with key=(node_uri, private_key), value=EvmPublisher
+_publishers_lock = threading.Lock()
+
+class EvmPublisher:
+    web3 = None
+    account = None
+    gas_price_ttl = _gas_price_ttl
+    nonce = None #next nonce to use, None if it has to be fetched
+    gas_price = None
+    gas_price_time = 0.0
+    signed = None #dict with key=root, value=signed transaction not accepted yet
+    lock = None
+
+    def __init__(self, node_uri, private_key, timeout=None, gas_price_ttl=_gas_price_ttl, web3=None):
+        # web3: optional ready Web3 instance, e.g. one on an in-process test chain
+        if web3 is None:
+            import requests
+            from web3 import Web3
+            session = requests.Session()
+            request_kwargs = {"timeout": timeout} if timeout is not None else None
+            web3 = Web3(Web3.HTTPProvider(node_uri, request_kwargs=request_kwargs, session=session))
+        self.web3 = web3
+        self.account = web3.eth.account.from_key(private_key)
+        self.gas_price_ttl = gas_price_ttl
+        self.signed = {}
+        self.lock = threading.Lock()
+
+    def _next_nonce(self, consume=True):
+        with self.lock:
+            if self.nonce is None:
+                self.nonce = self.web3.eth.getTransactionCount(self.account.address, "pending")
+            nonce = self.nonce
+            if consume:
+                self.nonce += 1
+            return nonce
+
+    def _gas_price(self):
+        with self.lock:
+            now = time.monotonic()
+            if self.gas_price is None or now - self.gas_price_time > self.gas_price_ttl:
+                self.gas_price = self.web3.eth.gasPrice
+                self.gas_price_time = now
+            return self.gas_price
+
+    def build_transaction(self, root, nonce):
+        recipient = self.web3.toChecksumAddress("0x" + root[:40]) #trick to publish block_root via to_address
+        gas = self.web3.eth.estimateGas({"from": self.account.address, "to": recipient, "value": 0})
+        tx = {
+            "nonce": nonce,
+            "to": recipient,
+            "value": 0,
+            "gas": int(gas * _gas_margin),
+            "gasPrice": self._gas_price()
+        }
+        return tx
+
+    def _forget_nonce(self):
+        # local nonce may be off now, the next new transaction asks the node again
+        with self.lock:
+            self.nonce = None
+
+    def _delivered(self, signed_tx, error):
+        # True if the node already has this transaction, e.g. from an attempt that timed out
+        text = str(error).lower()
+        if "already known" in text or "known transaction" in text:
+            return True
+        try:
+            return self.web3.eth.getTransaction(signed_tx.hash) is not None
+        except Exception:
+            return False
+
+    def publish(self, root, dummy=False, channel="evm"):
+        if dummy:
+            signed_tx = self.account.sign_transaction(self.build_transaction(root, self._next_nonce(consume=False)))
+            print("-dummy-", "not publishing on", channel, signed_tx)
+            return None
+        with self.lock:
+            signed_tx = self.signed.get(root)
+        if signed_tx is None:
+            try:
+                signed_tx = self.account.sign_transaction(self.build_transaction(root, self._next_nonce()))
+            except Exception:
+                self._forget_nonce()
+                raise
+            with self.lock:
+                self.signed[root] = signed_tx
+        try:
+            tx_hash = self.web3.eth.sendRawTransaction(signed_tx.rawTransaction)
+        except Exception as e:
+            if not self._delivered(signed_tx, e):
+                if isinstance(e, ValueError):
+                    # rejected by the node (web3 raises RPC errors as ValueError), sign again next time
+                    with self.lock:
+                        self.signed.pop(root, None)
+                self._forget_nonce()
+                raise
+            tx_hash = signed_tx.hash
+        with self.lock:
+            self.signed.pop(root, None)
+        return tx_hash
+
+def get_publisher(node_uri, private_key, timeout=None, gas_price_ttl=_gas_price_ttl):
+    # shared publisher for this node and key, created on first use
+    with _publishers_lock:
+        key = (node_uri, private_key)
+        if key not in _publishers:
+            _publishers[key] = EvmPublisher(node_uri, private_key, timeout, gas_price_ttl)
+        return _publishers[key]
@@ -0,0 +1,90 @@
+import subprocess
+
+# git plumbing for the git publish channel
+#
+# Nothing here walks the working tree: the paths to stage come from the scan
+# that just ran and from the index stat data (modified and deleted tracked
+# files), new paths are checked against every ignore source of git (the
+# walker only reads .gitignore files), and the commit is written from the
+# index with write-tree, commit-tree and update-ref. All commands get
+# argument lists, paths go through stdin NUL-separated, so no quoting issues.
+# The remote can be any git url, e.g. a local bare repository.
+
+class GitError(Exception):
+    pass
+
+class GitRepository:
+    cwd = None
+    dummy = False
+    commands = None #list of argument lists run (or, with dummy, skipped) so far
+
+    def __init__(self, cwd=".", dummy=False):
+        self.cwd = cwd
+        self.dummy = dummy
+        self.commands = []
+
+    def run(self, args, stdin=None, check=True, writes=False):
+        # writes=True: changes the repository, only printed when dummy
+        self.commands.append(args)
+        if writes and self.dummy:
+            print("-dummy-", "not running", " ".join(["git"] + args))
+            return ""
+        result = subprocess.run(["git"] + args, cwd=self.cwd, input=stdin, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, universal_newlines=True)
+        if check and result.returncode != 0:
+            raise GitError(" ".join(["git"] + args) + ": " + result.stderr.strip())
+        return result.stdout if result.returncode == 0 else None
+
+    def ignored(self, paths):
+        # subset of untracked paths excluded by .gitignore, .git/info/exclude or core.excludesFile,
+        # one process for all of them
+        if len(paths) == 0:
+            return set()
+        output = self.run(["check-ignore", "-z", "--stdin"], "\0".join(paths) + "\0", check=False)
+        return set(path for path in (output or "").split("\0") if len(path) > 0)
+
+    def tracked(self):
+        # all paths in the index (reads the index only)
+        return set(path for path in self.run(["ls-files", "-z"]).split("\0") if len(path) > 0)
+
+    def modified(self):
+        # tracked paths whose stat data differs from the index, deleted ones included (no hashing)
+        output = self.run(["diff-files", "--name-only", "--relative", "-z"])
+        return [path for path in output.split("\0") if len(path) > 0]
+
+    def stage(self, paths):
+        # adds/updates existing paths and removes vanished ones, regardless of ignore rules,
+        # so callers filter new paths through `ignored` first
+        if len(paths) == 0:
+            return
+        self.run(["update-index", "--add", "--remove", "-z", "--stdin"], "\0".join(paths) + "\0", writes=True)
+
+    def staged_summary(self):
+        # index against HEAD, no working tree involved
+        return self.run(["diff", "--cached", "--stat"], check=False) or ""
+
+    def head(self):
+        output = self.run(["rev-parse", "--verify", "-q", "HEAD"], check=False)
+        return output.strip() if output else None
+
+    def commit(self, message):
+        # commit of the current index on top of HEAD, returns the commit id (None if nothing changed)
+        parent = self.head()
+        tree = self.run(["write-tree"], writes=True).strip()
+        if self.dummy:
+            return None
+        if parent is not None and self.run(["rev-parse", parent + "^{tree}"]).strip() == tree:
+            return None
+        args = ["commit-tree", tree, "-m", message]
+        if parent is not None:
+            args += ["-p", parent]
+        commit = self.run(args).strip()
+        self.run(["update-ref", "-m", "commit: " + message.split("\n")[0], "HEAD", commit, parent or ""])
+        return commit
+
+    def push(self, remote=None, branch=None):
+        # without remote the configured upstream is used, like a plain `git push`
+        args = ["push", "--quiet"]
+        if remote is not None:
+            args += [remote, "HEAD" if branch is None else "HEAD:refs/heads/" + branch]
+        self.run(args, writes=True)
@@ -0,0 +1,160 @@
+import os
+import threading
+import digestcache
+import instrument
+import treehash
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# hashlib releases the GIL while digesting buffers larger than 2047 bytes, so
+# threads scale well for larger files. A tree of mostly tiny files is
+# dominated by open/read/close overhead under the GIL, which is what the
+# process pool is for.
+#
+# Reading goes through one reusable buffer per thread (`readinto`), so no
+# bytes object is allocated per block. Big files are read the same way:
+# mapping them would crash the process with SIGBUS if another process
+# truncated the file while it is hashed, here that is a short read.
+#
+# `hashing` is one algorithm name or a tuple of names. With a tuple every
+# chunk feeds all hashers, so more algorithms cost CPU but no extra reads,
+# and a digest is the tuple of hex digests in the same order.
+# Tree-hash modes (treehash.py) hash the chunks of one big file concurrently
+# instead, as long as all requested algorithms are tree modes.
+_min_blocksize = 65536
+_max_blocksize = 1048576
+_small_file_size = 16384
+_small_file_share = 0.9
+_process_pool_min_files = 2000
+_process_pool_batch = 256
+_tree_parallel_chunks = 4 #files with at least this many chunks get all workers for themselves
+
+_buffers = threading.local()
+
+def pick_blocksize(size, blocksize=None):
+    # a configured blocksize wins, otherwise read small files in one go and
+    # larger ones in `_max_blocksize` steps
+    if blocksize:
+        return blocksize
+    if size >= _max_blocksize:
+        return _max_blocksize
+    return max(_min_blocksize, -(-(size + 1) // _min_blocksize) * _min_blocksize)
+
+def _buffer(blocksize):
+    buf = getattr(_buffers, "buf", None)
+    if buf is None or len(buf) < blocksize:
+        buf = bytearray(blocksize)
+        _buffers.buf = buf
+    return buf
+
+def _advise_sequential(fd):
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        except OSError:
+            pass
+
+def hash_file(path, hashing, blocksize=None):
+    single = isinstance(hashing, str)
+    algos = [treehash.new(hashing)] if single else [treehash.new(name) for name in hashing]
+    try:
+        with open(path, 'rb', buffering=0) as f:
+            size = os.fstat(f.fileno()).st_size
+            blocksize = pick_blocksize(size, blocksize)
+            _advise_sequential(f.fileno())
+            buf = _buffer(blocksize)
+            with memoryview(buf) as view:
+                n = f.readinto(view)
+                while n:
+                    with view[:n] as chunk:
+                        for algo in algos:
+                            algo.update(chunk)
+                    n = f.readinto(view)
+    except (OSError, ValueError):
+        #unreadable, vanished or no regular file: no digest, rather than the digest of what was read
+        return None
+    if single:
+        return algos[0].hexdigest()
+    return tuple(algo.hexdigest() for algo in algos)
+
+def _hash_batch(paths, hashing, blocksize):
+    return [hash_file(path, hashing, blocksize) for path in paths]
+
+def _use_processes(sizes):
+    if len(sizes) < _process_pool_min_files:
+        return False
+    small = sum(1 for size in sizes if size < _small_file_size)
+    return small >= _small_file_share * len(sizes)
+
+def _hash_with_threads(paths, hashing, jobs, blocksize):
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(lambda path: hash_file(path, hashing, blocksize), paths))
+
+def _hash_with_processes(paths, hashing, jobs, blocksize):
+    batches = [paths[i:i+_process_pool_batch] for i in range(0, len(paths), _process_pool_batch)]
+    digests = []
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        for batch_digests in pool.map(_hash_batch, batches, [hashing]*len(batches), [blocksize]*len(batches)):
+            digests.extend(batch_digests)
+    return digests
+
+def hash_files(paths, hashing, jobs=None, cache=None, blocksize=None, stats=None):
+    # returns the hex digests in the order of `paths`, independent of scheduling,
+    # None for files that could not be read (those are not cached either)
+    # stats: optional list of os.stat_result matching `paths`, saves a stat per file
+    if jobs is None or jobs < 1:
+        jobs = os.cpu_count() or 1
+    digests = [None] * len(paths)
+    todo = [] #list of (index, path, stat)
+    for index, path in enumerate(paths):
+        if stats is not None:
+            st = stats[index]
+        else:
+            st = digestcache.stat_file(path)
+        if cache is not None:
+            if isinstance(hashing, str):
+                digests[index] = cache.lookup(path, st, hashing)
+            else:
+                cached = tuple(cache.lookup(path, st, name) for name in hashing)
+                if None not in cached:
+                    digests[index] = cached
+        if digests[index] is None:
+            todo.append((index, path, st))
+    chunk_size = treehash.common_chunk_size([hashing] if isinstance(hashing, str) else hashing)
+    if chunk_size > 0 and jobs > 1:
+        # one big file after the other, each with all workers on its chunks
+        big = [item for item in todo if item[2] is not None and item[2].st_size >= _tree_parallel_chunks * chunk_size]
+        todo = [item for item in todo if item[2] is None or item[2].st_size < _tree_parallel_chunks * chunk_size]
+    else:
+        big = []
+    todo_paths = [path for (index, path, st) in todo]
+    if instrument.enabled:
+        instrument.count("cache_hits", len(paths) - len(todo))
+        instrument.count("files_hashed", len(todo) + len(big))
+        instrument.count("bytes_read", sum(st.st_size for (index, path, st) in todo + big if st is not None))
+    if jobs == 1 or len(todo) < 2:
+        computed = _hash_batch(todo_paths, hashing, blocksize)
+    elif _use_processes([st.st_size if st is not None else 0 for (index, path, st) in todo]):
+        try:
+            computed = _hash_with_processes(todo_paths, hashing, jobs, blocksize)
+        except (OSError, BrokenProcessPool):
+            #no process support on this platform (or sandbox), threads still help
+            computed = _hash_with_threads(todo_paths, hashing, jobs, blocksize)
+    else:
+        computed = _hash_with_threads(todo_paths, hashing, jobs, blocksize)
+    for (index, path, st) in big:
+        try:
+            computed.append(treehash.parallel_digest(path, hashing, jobs))
+        except OSError:
+            #vanished or unreadable, same as hash_file
+            computed.append(hash_file(path, hashing, blocksize))
+    todo += big
+    for ((index, path, st), digest) in zip(todo, computed):
+        digests[index] = digest
+        if cache is not None and digest is not None:
+            if isinstance(hashing, str):
+                cache.store(path, st, hashing, digest)
+            else:
+                for (name, value) in zip(hashing, digest):
+                    cache.store(path, st, name, value)
+    return digests
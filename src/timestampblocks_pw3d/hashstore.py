@@ -0,0 +1,206 @@
+import os
+import sys
+import sqlite3
+from pathlib import Path
+
+# storage backends for HashBlock state (see hashblock.py for the text format)
+#
+# Both stores offer
+# | load(hash_method, file_names): dict with key=path, value=(file_hash, timestamp)
+# |     of stored entries that still exist, in stored order (new lines first)
+# | save(hash_method, total, new, old, new_lines, old_lines)
+# TextHashStore rewrites the whole hashfile on save. SqliteHashStore keeps
+# one row per path and only touches the rows that changed: written entries,
+# and entries of files that disappeared.
+#
+# Rows keep their text-file position in `seq`. New lines are added below the
+# smallest seq, which puts them in front like the rewritten text file does.
+# `run` is the save that wrote a row, rows of the latest save are the new lines.
+
+_sqlite_suffixes = (".sqlite", ".sqlite3", ".db")
+_sqlite_side_files = ("-journal", "-wal", "-shm")
+
+class TextHashStore:
+    hashfile = None
+
+    def __init__(self, hashfile):
+        self.hashfile = hashfile
+
+    def files(self):
+        return [self.hashfile]
+
+    def load(self, hash_method, file_names):
+        old_lines = {}
+        if not Path(self.hashfile).exists():
+            return old_lines
+        lines = Path(self.hashfile).read_text().splitlines()
+        if len(lines) == 0 or lines[0].lower() != hash_method.lower():
+            #only do hash comparison if using the same hash_method again
+            return old_lines
+        for line in lines[1:]:
+            try:
+                (key, value, timestamp) = line.split()
+                if key in old_lines:
+                    raise Exception("duplicate entry: "+key)
+                if key in file_names:
+                    old_lines[key] = (value, timestamp)
+            except:
+                #not a hashline
+                pass
+        return old_lines
+
+    def save(self, hash_method, total_hash, new_hash, old_hash, new_lines, old_lines):
+        write_text(self.hashfile, hash_method, total_hash, new_hash, old_hash, new_lines, old_lines)
+
+    def close(self):
+        pass
+
+class SqliteHashStore:
+    dbfile = None
+    connection = None
+    stored = None #set of stored paths, filled by load
+
+    def __init__(self, dbfile):
+        self.dbfile = dbfile
+        self.stored = set()
+
+    def files(self):
+        return [self.dbfile] + [self.dbfile + suffix for suffix in _sqlite_side_files]
+
+    def _connect(self):
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.dbfile)
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries (path TEXT PRIMARY KEY, hash TEXT, timestamp TEXT, "
+                "seq INTEGER, run INTEGER)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS entries_seq ON entries (seq)")
+        return self.connection
+
+    def meta(self):
+        return dict(self._connect().execute("SELECT key, value FROM meta"))
+
+    def load(self, hash_method, file_names):
+        connection = self._connect()
+        old_lines = {}
+        self.stored = set()
+        if self.meta().get("hash_method", "").lower() != hash_method.lower():
+            return old_lines
+        for (path, value, timestamp) in connection.execute("SELECT path, hash, timestamp FROM entries ORDER BY seq"):
+            self.stored.add(path)
+            if path in file_names:
+                old_lines[path] = (value, timestamp)
+        return old_lines
+
+    def save(self, hash_method, total_hash, new_hash, old_hash, new_lines, old_lines):
+        connection = self._connect()
+        meta = self.meta()
+        with connection:
+            if meta.get("hash_method", "").lower() != hash_method.lower():
+                connection.execute("DELETE FROM entries")
+                self.stored = set()
+            gone = [(path,) for path in self.stored if path not in old_lines and path not in new_lines]
+            connection.executemany("DELETE FROM entries WHERE path = ?", gone)
+            run = int(meta.get("run", "0")) + 1
+            first = connection.execute("SELECT MIN(seq) FROM entries").fetchone()[0]
+            first = (first if first is not None else 0) - len(new_lines)
+            connection.executemany(
+                "INSERT OR REPLACE INTO entries (path, hash, timestamp, seq, run) VALUES (?, ?, ?, ?, ?)",
+                ((path, new_lines[path][0], new_lines[path][1], first + i, run) for (i, path) in enumerate(new_lines))
+            )
+            connection.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", [
+                ("hash_method", hash_method), ("total", total_hash), ("new", new_hash), ("old", old_hash),
+                ("run", str(run)),
+            ])
+        self.stored = set(old_lines) | set(new_lines)
+
+    def sections(self):
+        # (meta, new lines, old lines) as the text format has them
+        meta = self.meta()
+        run = int(meta.get("run", "0"))
+        new_lines = {}
+        old_lines = {}
+        for (path, value, timestamp, row_run) in self._connect().execute(
+                "SELECT path, hash, timestamp, run FROM entries ORDER BY seq"):
+            (new_lines if row_run == run else old_lines)[path] = (value, timestamp)
+        return meta, new_lines, old_lines
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+def write_text(hashfile, hash_method, total_hash, new_hash, old_hash, new_lines, old_lines):
+    new_output_lines = [' '.join([vkey, new_lines[vkey][0], new_lines[vkey][1]]) for vkey in new_lines]
+    old_output_lines = [' '.join([vkey, old_lines[vkey][0], old_lines[vkey][1]]) for vkey in old_lines]
+    with open(hashfile, 'w') as file:
+        file.write(hash_method+'\n')
+        file.write('total: '+total_hash+'\n')
+        file.write('new: '+new_hash+'\n')
+        file.write('old: '+old_hash+'\n')
+        file.write('- + - newlines - + -'+'\n')
+        file.write('\n'.join(new_output_lines)+'\n')
+        file.write('- + - oldlines - + -'+'\n')
+        file.write('\n'.join(old_output_lines)+'\n')
+
+def open_store(hashfile):
+    # backend by file name, e.g. "hashes.sqlite" for SqliteHashStore
+    if hashfile.endswith(_sqlite_suffixes):
+        return SqliteHashStore(hashfile)
+    return TextHashStore(hashfile)
+
+def export_text(dbfile, hashfile):
+    store = SqliteHashStore(dbfile)
+    (meta, new_lines, old_lines) = store.sections()
+    store.close()
+    if "hash_method" not in meta:
+        raise ValueError(dbfile + " holds no HashBlock state")
+    write_text(hashfile, meta["hash_method"], meta["total"], meta["new"], meta["old"], new_lines, old_lines)
+
+def import_text(hashfile, dbfile):
+    # replaces the database content with the text file's sections
+    lines = Path(hashfile).read_text().splitlines()
+    meta = {"hash_method": lines[0]}
+    new_lines = {}
+    old_lines = {}
+    section = None
+    for line in lines[1:]:
+        if line == "- + - newlines - + -":
+            section = new_lines
+        elif line == "- + - oldlines - + -":
+            section = old_lines
+        elif section is None and ": " in line:
+            (key, value) = line.split(": ", 1)
+            meta[key] = value
+        elif section is not None and len(line.split()) == 3:
+            (key, value, timestamp) = line.split()
+            section[key] = (value, timestamp)
+    store = SqliteHashStore(dbfile)
+    connection = store._connect()
+    with connection:
+        connection.execute("DELETE FROM entries")
+        connection.execute("DELETE FROM meta")
+        rows = [(path, new_lines[path][0], new_lines[path][1], 1) for path in new_lines]
+        rows += [(path, old_lines[path][0], old_lines[path][1], 0) for path in old_lines if path not in new_lines]
+        connection.executemany(
+            "INSERT OR REPLACE INTO entries (path, hash, timestamp, seq, run) VALUES (?, ?, ?, ?, ?)",
+            ((path, value, timestamp, seq, run) for (seq, (path, value, timestamp, run)) in enumerate(rows))
+        )
+        connection.executemany("INSERT INTO meta (key, value) VALUES (?, ?)", [
+            ("hash_method", meta["hash_method"]), ("total", meta.get("total", "")), ("new", meta.get("new", "")),
+            ("old", meta.get("old", "")), ("run", "1"),
+        ])
+    store.close()
+
+if __name__ == "__main__":
+    # python hashstore.py export hashes.sqlite hashes.txt
+    # python hashstore.py import hashes.txt hashes.sqlite
+    if len(sys.argv) != 4 or sys.argv[1] not in ("export", "import"):
+        print("usage:", os.path.basename(sys.argv[0]), "export <db> <textfile> | import <textfile> <db>")
+        sys.exit(2)
+    if sys.argv[1] == "export":
+        export_text(sys.argv[2], sys.argv[3])
+    else:
+        import_text(sys.argv[2], sys.argv[3])
@@ -0,0 +1,106 @@
+import time
+import contextlib
+
+# phase timing and I/O counters behind `--stats` / `--stats-json`
+#
+# `phase(name)` measures wall and CPU time (process wide, so hashing threads
+# count, process pool workers do not) of a named phase. Phases may nest, a
+# phase entered several times accumulates. `count(name, n)` adds to a counter.
+# Both are cheap, but code on per-file paths should still check `enabled`.
+#
+# Profiling hook: `set_profiler(name, start, stop)` calls start() when phase
+# `name` is entered and stop() when it is left, so any profiler can be scoped
+# to one phase. `profile_with_cprofile` is the ready-made cProfile variant,
+# it collects over every entry of its phase and reports once in `finish`.
+# Note that cProfile only sees the calling thread, use `-j 1` to get hashing
+# into the profile.
+
+enabled = False
+phases = {} #dict with key=phase name, value=[calls, wall seconds, cpu seconds]
+counters = {} #dict with key=counter name, value=number
+channels = {} #dict with key=channel, value=publish result (see publishing.py)
+_profilers = {} #dict with key=phase name, value=(start, stop)
+_finishers = [] #callables for `finish`, e.g. writing a profile
+
+def reset():
+    phases.clear()
+    counters.clear()
+    channels.clear()
+
+@contextlib.contextmanager
+def phase(name):
+    profiler = _profilers.get(name)
+    if profiler is not None:
+        profiler[0]()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        yield
+    finally:
+        entry = phases.setdefault(name, [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += time.perf_counter() - wall
+        entry[2] += time.process_time() - cpu
+        if profiler is not None:
+            profiler[1]()
+
+def count(name, n=1):
+    counters[name] = counters.get(name, 0) + n
+
+def record_channel(result):
+    channels[result["channel"]] = result
+
+def set_profiler(name, start, stop):
+    _profilers[name] = (start, stop)
+
+def profile_with_cprofile(name, outfile=None):
+    # stats go to outfile (for pstats/snakeviz) or as top 30 to stdout
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile()
+    def write():
+        if name not in phases:
+            return
+        if outfile is not None:
+            profiler.dump_stats(outfile)
+        else:
+            pstats.Stats(profiler).sort_stats("cumulative").print_stats(30)
+    set_profiler(name, profiler.enable, profiler.disable)
+    _finishers.append(write)
+
+def finish():
+    # end of the run, once, however often the profiled phase was entered
+    while len(_finishers) > 0:
+        _finishers.pop(0)()
+
+def report():
+    # plain dict for json, derived rates included
+    result = {
+        "phases": {
+            name: {"calls": entry[0], "wall_s": round(entry[1], 6), "cpu_s": round(entry[2], 6)}
+            for (name, entry) in phases.items()
+        },
+        "counters": dict(counters),
+        "channels": {
+            channel: {key: result[key] for key in ("status", "attempts", "seconds", "error")}
+            for (channel, result) in channels.items()
+        },
+    }
+    if "hash" in phases and phases["hash"][1] > 0:
+        result["hash_mb_per_s"] = round(counters.get("bytes_read", 0) / 1e6 / phases["hash"][1], 3)
+    return result
+
+def summary_lines():
+    data = report()
+    lines = ["phase                 calls      wall s       cpu s"]
+    for (name, entry) in data["phases"].items():
+        lines.append("%-20s %6d %11.4f %11.4f" % (name, entry["calls"], entry["wall_s"], entry["cpu_s"]))
+    for name in sorted(data["counters"]):
+        value = data["counters"][name]
+        lines.append(("%-32s %.4f" if isinstance(value, float) else "%-32s %d") % (name, value))
+    if "hash_mb_per_s" in data:
+        lines.append("%-32s %.1f" % ("hash MB/s", data["hash_mb_per_s"]))
+    for (channel, result) in data["channels"].items():
+        lines.append("publish %-24s %s after %d attempt(s), %.3fs" % (
+            channel, result["status"], result["attempts"], result["seconds"]))
+    return lines
@@ -0,0 +1,115 @@
+import sys
+import hashlib
+import merkle
+from array import array
+from bisect import bisect_left
+
+# compact membership store for known digests of one hashing algorithm
+#
+# A hex str in a set costs well over 150 bytes per sha384 digest, here it is
+# the raw digest size plus four bytes: one sorted bytes object of
+# concatenated digests, an array of their first four bytes as integers (so
+# bisect runs entirely in C) and a small set of recent additions, which
+# `compact` merges into the sorted part. Every merge copies all of data, so
+# the set may grow with data (by `_compact_ratio`), which keeps building a
+# store of n digests at O(n log n) instead of O(n^2).
+# Tokens that are not digests of this algorithm (timestamps, roots of other
+# algorithms) are dropped, they can never be a file digest of this algorithm.
+
+_compact_threshold = 65536 #pending digests that trigger `compact`, at least
+_compact_ratio = 8 #or one in this many merged digests, whichever is more
+_key_size = 4
+
+def _keys(data, width):
+    # big endian integer of the first _key_size bytes of every item
+    count = len(data) // width
+    interleaved = bytearray(count * _key_size)
+    for i in range(_key_size):
+        interleaved[i::_key_size] = data[i:count*width:width]
+    keys = array('I', bytes(interleaved))
+    if sys.byteorder == "little":
+        keys.byteswap()
+    return keys
+
+class KnownHashes:
+    hashing = None
+    digest_size = 0
+    data = b"" #sorted, unique, concatenated raw digests
+    keys = None #array with the first bytes of every digest in data, as integer
+    pending = None #set of raw digests not yet merged into data
+
+    def __init__(self, hashing, data=b""):
+        # data: output of `to_bytes`, e.g. read from a snapshot file
+        self.hashing = hashing
+        self.digest_size = hashlib.new(merkle.base_hashing(hashing)).digest_size
+        self.data = bytes(data)
+        self.keys = _keys(self.data, self.digest_size)
+        self.pending = set()
+
+    def _position(self, raw):
+        # index of raw in data, or its insertion point as negative number - 1
+        key = int.from_bytes(raw[:_key_size], "big")
+        index = bisect_left(self.keys, key)
+        width = self.digest_size
+        while index < len(self.keys) and self.keys[index] == key:
+            item = self.data[index*width:(index+1)*width]
+            if item == raw:
+                return index
+            if item > raw:
+                break
+            index += 1
+        return -index - 1
+
+    def _raw(self, hex_value):
+        if len(hex_value) != 2 * self.digest_size:
+            return None
+        try:
+            return bytes.fromhex(hex_value)
+        except ValueError:
+            return None
+
+    def _contains_raw(self, raw):
+        return raw in self.pending or self._position(raw) >= 0
+
+    def __contains__(self, hex_value):
+        raw = self._raw(hex_value)
+        return raw is not None and self._contains_raw(raw)
+
+    def __len__(self):
+        self.compact()
+        return len(self.data) // self.digest_size
+
+    def add(self, hex_value):
+        # duplicates of merged digests are dropped in `compact`
+        raw = self._raw(hex_value)
+        if raw is not None:
+            self.pending.add(raw)
+            if len(self.pending) >= max(_compact_threshold, len(self.keys) // _compact_ratio):
+                self.compact()
+
+    def update(self, hex_values):
+        for hex_value in hex_values:
+            self.add(hex_value)
+
+    def compact(self):
+        # splice the sorted pending digests into data, one copy of data
+        if len(self.pending) == 0:
+            return
+        parts = []
+        start = 0
+        for raw in sorted(self.pending):
+            position = self._position(raw)
+            if position >= 0:
+                continue
+            index = (-position - 1) * self.digest_size
+            parts.append(self.data[start:index])
+            parts.append(raw)
+            start = index
+        parts.append(self.data[start:])
+        self.data = b"".join(parts)
+        self.keys = _keys(self.data, self.digest_size)
+        self.pending = set()
+
+    def to_bytes(self):
+        self.compact()
+        return self.data
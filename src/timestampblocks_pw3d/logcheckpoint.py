@@ -0,0 +1,205 @@
+import os
+import configparser
+import hashlib
+import knownhashes
+import digestindex
+
+# checkpoint sidecar for incremental reading of timestampblocks.log
+#
+# checkpoint file (configparser format):
+# | [checkpoint]
+# | offset = byte offset right after the last verified `#root` line
+# | log-version, hashing, last-root = parser state at that offset
+# | fingerprint = sha256 of all log bytes before offset
+# | [roots]
+# | <hashing> = last root per hashing algorithm
+# | [known]
+# | <hashing> = number of valid bytes in `<knownprefix><hashing>`
+# | [index]
+# | <hashing> = generation:size of every segment of `<indexprefix><hashing>-*`
+#
+# known files are knownhashes.KnownHashes snapshots (sorted raw digests) of
+# all data lines up to offset, index segments (see digestindex.py) map the
+# digests of all blocks up to offset to the block that first had them.
+# The fingerprint guards the checkpointed prefix: raw hashing is much cheaper
+# than parsing and verifying every block, and if any byte before offset was
+# changed, the log is read and verified from the start again. The hasher of a
+# matching prefix is kept, so `save` only hashes the bytes appended since.
+
+_checkpoint_version = 4
+_read_size = 1048576
+
+class LogCheckpoint:
+    checkpointfile = None
+    knownprefix = None
+    indexprefix = None
+    offset = 0
+    log_version = 0
+    hashing = ""
+    last_root = ""
+    roots = None #dict with key=hashing, value=last root
+    known_sizes = None #dict with key=hashing, value=size of known file
+    known = None #dict with key=hashing, value=loaded KnownHashes
+    changed = None #set of hashings whose KnownHashes need to be written
+    indexes = None #dict with key=hashing, value=digestindex.DigestIndex
+    fingerprint = ""
+    hasher = None #sha256 over the log up to hashed_offset
+    hashed_offset = 0
+
+    def __init__(self, checkpointfile, knownprefix, indexprefix):
+        self.checkpointfile = checkpointfile
+        self.knownprefix = knownprefix
+        self.indexprefix = indexprefix
+        self.roots = {}
+        self.known_sizes = {}
+        self.known = {}
+        self.changed = set()
+        self.indexes = {}
+
+    def load(self):
+        settings = configparser.ConfigParser(interpolation=None)
+        settings.optionxform = str
+        try:
+            settings.read(self.checkpointfile)
+            section = settings["checkpoint"]
+            if int(section["version"]) != _checkpoint_version:
+                return False
+            self.offset = int(section["offset"])
+            self.log_version = int(section["log-version"])
+            self.hashing = section["hashing"]
+            self.last_root = section["last-root"]
+            self.fingerprint = section["fingerprint"]
+            self.roots = dict(settings["roots"]) if settings.has_section("roots") else {}
+            self.known_sizes = {}
+            if settings.has_section("known"):
+                for hashing in settings["known"]:
+                    self.known_sizes[hashing] = int(settings["known"][hashing])
+            self.indexes = {}
+            if settings.has_section("index"):
+                for hashing in settings["index"]:
+                    segments = [segment.split(":") for segment in settings["index"][hashing].split()]
+                    self.indexes[hashing] = digestindex.DigestIndex(
+                        self.indexprefix, hashing, [(int(generation), int(size)) for (generation, size) in segments]
+                    )
+        except (KeyError, ValueError, configparser.Error):
+            return False
+        return True
+
+    def matches(self, logfile, fingerprint=True):
+        # True if the checkpointed prefix of logfile still looks the same,
+        # fingerprint=False only compares sizes, for read-only queries
+        try:
+            if os.path.getsize(logfile) < self.offset:
+                return False
+            for hashing in self.known_sizes:
+                if os.path.getsize(self.knownprefix + hashing) != self.known_sizes[hashing]:
+                    return False
+        except OSError:
+            return False
+        if not all(index.matches() for index in self.indexes.values()):
+            return False
+        if not fingerprint:
+            return True
+        (self.hasher, self.hashed_offset) = _hash_prefix(logfile, self.offset)
+        return self.hasher.hexdigest() == self.fingerprint
+
+    def reset(self):
+        # start over, the checkpoint file goes first so a crash cannot revive it
+        if os.path.exists(self.checkpointfile):
+            os.remove(self.checkpointfile)
+        for hashing in self.known_sizes:
+            if os.path.exists(self.knownprefix + hashing):
+                os.remove(self.knownprefix + hashing)
+        for index in self.indexes.values():
+            index.remove()
+        self.offset = 0
+        self.log_version = 0
+        self.hashing = ""
+        self.last_root = ""
+        self.roots = {}
+        self.known_sizes = {}
+        self.known = {}
+        self.changed = set()
+        self.indexes = {}
+        self.fingerprint = ""
+        self.hasher = None
+        self.hashed_offset = 0
+
+    def read_known(self, hashing):
+        if hashing not in self.known:
+            data = b""
+            if self.known_sizes.get(hashing, 0) > 0:
+                with open(self.knownprefix + hashing, "rb") as f:
+                    data = f.read()
+            self.known[hashing] = knownhashes.KnownHashes(hashing, data)
+        return self.known[hashing]
+
+    def read_index(self, hashing):
+        if hashing not in self.indexes:
+            self.indexes[hashing] = digestindex.DigestIndex(self.indexprefix, hashing)
+        return self.indexes[hashing]
+
+    def advance(self, offset, log_version, hashing, last_root, roots, tokens, block_offset, leaves):
+        # called for every verified `#root` line, tokens: dict hashing -> list
+        # leaves: file digests of the block whose data line starts at block_offset
+        self.offset = offset
+        self.log_version = log_version
+        self.hashing = hashing
+        self.last_root = last_root
+        self.roots = dict(roots)
+        for key in tokens:
+            self.read_known(key).update(tokens[key])
+            self.changed.add(key)
+        self.read_index(hashing).update(leaves, block_offset)
+
+    def flush(self):
+        for hashing in self.changed:
+            filename = self.knownprefix + hashing
+            data = self.known[hashing].to_bytes()
+            with open(filename + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(filename + ".tmp", filename)
+            self.known_sizes[hashing] = len(data)
+        self.changed = set()
+        for index in self.indexes.values():
+            index.flush()
+
+    def save(self, logfile):
+        self.flush()
+        (self.hasher, self.hashed_offset) = _hash_prefix(logfile, self.offset, self.hasher, self.hashed_offset)
+        self.fingerprint = self.hasher.hexdigest()
+        settings = configparser.ConfigParser(interpolation=None)
+        settings.optionxform = str
+        settings["checkpoint"] = {
+            "version": str(_checkpoint_version),
+            "offset": str(self.offset),
+            "log-version": str(self.log_version),
+            "hashing": self.hashing,
+            "last-root": self.last_root,
+            "fingerprint": self.fingerprint,
+        }
+        settings["roots"] = self.roots
+        settings["known"] = {hashing: str(self.known_sizes[hashing]) for hashing in self.known_sizes}
+        settings["index"] = {hashing: self.indexes[hashing].state() for hashing in self.indexes}
+        tmpfile = self.checkpointfile + ".tmp"
+        with open(tmpfile, "w") as f:
+            settings.write(f)
+        os.replace(tmpfile, self.checkpointfile)
+        for index in self.indexes.values():
+            index.remove_obsolete()
+
+def _hash_prefix(logfile, offset, hasher=None, hashed_offset=0):
+    # (hasher, offset) over the first offset bytes of logfile, continuing hasher if given
+    if hasher is None:
+        hasher = hashlib.sha256()
+        hashed_offset = 0
+    if offset > hashed_offset:
+        with open(logfile, "rb") as f:
+            f.seek(hashed_offset)
+            while hashed_offset < offset:
+                data = f.read(min(_read_size, offset - hashed_offset))
+                if len(data) == 0:
+                    break
+                hasher.update(data)
+                hashed_offset += len(data)
+    return (hasher, hashed_offset)
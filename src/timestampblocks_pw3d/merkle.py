@@ -0,0 +1,119 @@
+import hashlib
+
+# merkle trees as in RFC 6962 (certificate transparency)
+#
+# leaf hash = hash(0x00 + leaf), node hash = hash(0x01 + left + right)
+# a tree of n leaves splits at the largest power of two below n, so the root
+# can be built incrementally with a stack of complete subtrees.
+# An inclusion proof is the list of (side, hex sibling) pairs from the leaf up,
+# side "L" meaning the sibling is on the left.
+#
+# `hashing` may also name a tree-hash mode like "sha256-tree-4m" (see
+# treehash.py), the nodes of such trees are plain sha256.
+
+_tree_marker = "-tree-"
+_size_units = {"k": 1024, "m": 1024**2, "g": 1024**3}
+
+def tree_mode(hashing):
+    # (algorithm, chunk size) of a tree-hash mode name, (hashing, 0) for plain algorithms
+    if _tree_marker not in hashing:
+        return hashing, 0
+    (algorithm, size) = hashing.split(_tree_marker, 1)
+    unit = _size_units.get(size[-1:].lower(), 1)
+    if unit > 1:
+        size = size[:-1]
+    if not size.isdigit() or int(size) == 0:
+        raise ValueError("invalid chunk size in hashing " + hashing)
+    return algorithm, int(size) * unit
+
+def base_hashing(hashing):
+    if _tree_marker not in hashing:
+        return hashing
+    return tree_mode(hashing)[0]
+
+def leaf_hash(hashing, leaf):
+    algo = hashlib.new(base_hashing(hashing))
+    algo.update(b"\x00" + leaf)
+    return algo.digest()
+
+def node_hash(hashing, left, right):
+    algo = hashlib.new(base_hashing(hashing))
+    algo.update(b"\x01" + left + right)
+    return algo.digest()
+
+class MerkleBuilder:
+    hashing = None
+    count = 0
+    stack = None #list of (leaf count, hash) of complete subtrees, largest first
+
+    def __init__(self, hashing):
+        self.hashing = hashing
+        self.stack = []
+
+    def add(self, leaf):
+        # leaf: bytes, usually a raw file digest
+        self.add_leaf_hash(leaf_hash(self.hashing, leaf))
+
+    def add_leaf_hash(self, node):
+        # for leaves hashed elsewhere, e.g. file chunks in treehash.py
+        size = 1
+        while len(self.stack) > 0 and self.stack[-1][0] == size:
+            (left_size, left) = self.stack.pop()
+            node = node_hash(self.hashing, left, node)
+            size += left_size
+        self.stack.append((size, node))
+        self.count += 1
+
+    def root(self):
+        if len(self.stack) == 0:
+            return hashlib.new(base_hashing(self.hashing)).digest()
+        node = self.stack[-1][1]
+        for (size, left) in reversed(self.stack[:-1]):
+            node = node_hash(self.hashing, left, node)
+        return node
+
+def merkle_root(leaves, hashing):
+    builder = MerkleBuilder(hashing)
+    for leaf in leaves:
+        builder.add(leaf)
+    return builder.root()
+
+def _split(n):
+    k = 1
+    while k * 2 < n:
+        k *= 2
+    return k
+
+def _root_of_leaf_hashes(nodes, hashing):
+    builder = MerkleBuilder(hashing)
+    for node in nodes:
+        builder.add_leaf_hash(node)
+    return builder.root()
+
+def merkle_proof(leaves, index, hashing):
+    # inclusion proof for leaves[index], O(n) hashing, O(log n) result
+    return proof_from_leaf_hashes([leaf_hash(hashing, leaf) for leaf in leaves], index, hashing)
+
+def proof_from_leaf_hashes(nodes, index, hashing):
+    if len(nodes) == 1:
+        return []
+    k = _split(len(nodes))
+    if index < k:
+        return proof_from_leaf_hashes(nodes[:k], index, hashing) + [
+            ("R", _root_of_leaf_hashes(nodes[k:], hashing).hex())]
+    return proof_from_leaf_hashes(nodes[k:], index - k, hashing) + [
+        ("L", _root_of_leaf_hashes(nodes[:k], hashing).hex())]
+
+def root_from_proof(leaf, proof, hashing):
+    # O(log n) recomputation of the root an inclusion proof leads to
+    return root_from_leaf_hash(leaf_hash(hashing, leaf), proof, hashing)
+
+def root_from_leaf_hash(node, proof, hashing):
+    for (side, sibling) in proof:
+        if side == "L":
+            node = node_hash(hashing, bytes.fromhex(sibling), node)
+        elif side == "R":
+            node = node_hash(hashing, node, bytes.fromhex(sibling))
+        else:
+            raise ValueError("invalid proof side: " + str(side))
+    return node
@@ -0,0 +1,95 @@
+import threading
+import time
+
+# concurrent publishing stage
+#
+# Every channel runs in its own daemon thread with exponential-backoff
+# retries. Waiting is bounded by the channel's timeout (covering all
+# attempts), a hanging node therefore only costs its own timeout and never
+# keeps the program from exiting. Each channel ends up with a result dict:
+# | channel: name of the channel
+# | status: "ok", "failed" or "timeout"
+# | response: whatever the publish function returned (e.g. a transaction id)
+# | attempts: number of started attempts
+# | seconds: wall time until the result (or the timeout)
+# | error: text of the last exception, if any
+
+_default_timeout = 120.0
+_default_retries = 2
+_default_backoff = 1.0
+
+class ChannelTask:
+    channel = None
+    function = None #callable without arguments, returns the response
+    timeout = _default_timeout
+    retries = _default_retries
+    backoff = _default_backoff
+    result = None
+    attempts = 0
+    error = None
+    response = None
+    started = 0.0
+    finished = 0.0
+    done = None #threading.Event
+
+    def __init__(self, channel, function, timeout=_default_timeout, retries=_default_retries, backoff=_default_backoff):
+        self.channel = channel
+        self.function = function
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.done = threading.Event()
+
+    def run(self):
+        self.started = time.monotonic()
+        delay = self.backoff
+        while True:
+            self.attempts += 1
+            try:
+                self.response = self.function()
+                self.error = None
+                break
+            except Exception as e:
+                self.error = type(e).__name__ + ": " + str(e)
+            if self.attempts > self.retries:
+                break
+            if time.monotonic() + delay - self.started >= self.timeout:
+                break
+            time.sleep(delay)
+            delay *= 2
+        self.finished = time.monotonic()
+        self.done.set()
+
+    def start(self):
+        self.started = time.monotonic()
+        thread = threading.Thread(target=self.run, name="publish-" + self.channel, daemon=True)
+        thread.start()
+
+    def wait(self):
+        finished = self.done.wait(max(0.0, self.timeout - (time.monotonic() - self.started)))
+        if not finished:
+            status = "timeout"
+            seconds = time.monotonic() - self.started
+        else:
+            status = "ok" if self.error is None else "failed"
+            seconds = self.finished - self.started
+        self.result = {
+            "channel": self.channel,
+            "status": status,
+            "response": self.response,
+            "attempts": self.attempts,
+            "seconds": round(seconds, 3),
+            "error": self.error,
+        }
+        return self.result
+
+def run_concurrently(tasks):
+    # results come back in the order of tasks
+    for task in tasks:
+        task.start()
+    return [task.wait() for task in tasks]
+
+def run_inline(task):
+    # for interactive channels, no timeout can be enforced here
+    task.run()
+    return task.wait()
@@ -0,0 +1,151 @@
+import os
+import time
+import heapq
+import hashlib
+import itertools
+import tempfile
+import digestcache
+import hashengine
+import instrument
+import merkle
+import walker
+
+# generator based scanning and block building, for programs that embed
+# timestamping instead of running the command line tool
+#
+# iter_file_digests walks and hashes a tree `batch` files at a time, so only
+# one batch of paths is held at once. BlockBuilder takes digests one by one:
+# v2 blocks list their digests sorted and without duplicates, so the builder
+# keeps raw digests and moves them to a sorted temporary file every `spill`
+# digests, the data line is then streamed from a merge of those runs.
+# | builder = stream.BlockBuilder("sha256", last_root)
+# | for (path, digest) in stream.iter_file_digests("data", hashing="sha256"):
+# |     if digest is not None and digest not in known:
+# |         builder.add(digest)
+# | with open("timestampblocks.log", "a") as log:
+# |     block = builder.write(log)
+
+_leaf_separator = "|" #v2 data lines: header tokens, separator, file digests
+_batch = 4096 #files per walk/hash round
+_spill = 1048576 #buffered digests per sorted run
+
+def iter_file_digests(root=".", ignorefile=".gitignore", hashing="sha384", extra_lines=(), cache=None, jobs=None,
+                      blocksize=None, batch=_batch):
+    # yields (path, digest) in walk order, path relative to root as walker.walk has it
+    # hashing: one algorithm (hex digest) or a tuple of them (tuple of hex digests)
+    # digest is None for files that could not be read
+    entries = walker.walk(root, ignorefile, extra_lines)
+    while True:
+        with instrument.phase("walk"):
+            paths = []
+            stats = []
+            for (path, entry) in itertools.islice(entries, batch):
+                paths.append(path)
+                stats.append(digestcache.stat_entry(entry))
+        if len(paths) == 0:
+            return
+        files = paths if root == "." else [os.path.join(root, path) for path in paths]
+        with instrument.phase("hash"):
+            digests = hashengine.hash_files(files, hashing, jobs, cache, blocksize, stats)
+        yield from zip(paths, digests)
+
+class BlockBuilder:
+    hashing = None
+    last_root = ""
+    last_proper_root = ""
+    digest_size = 0
+    spill = _spill
+    buffer = None #set of raw digests not in a run yet
+    runs = None #list of temporary files, each with sorted raw digests
+
+    def __init__(self, hashing, last_root="", last_proper_root="", spill=_spill):
+        self.hashing = hashing
+        self.last_root = last_root
+        self.last_proper_root = last_proper_root
+        self.digest_size = hashlib.new(merkle.base_hashing(hashing)).digest_size
+        self.spill = spill
+        self.buffer = set()
+        self.runs = []
+
+    def add(self, digest):
+        # digest: hex str, duplicates are dropped
+        raw = bytes.fromhex(digest)
+        if len(raw) != self.digest_size:
+            raise ValueError("not a " + self.hashing + " digest: " + digest)
+        self.buffer.add(raw)
+        if len(self.buffer) >= self.spill:
+            self._spill()
+
+    def update(self, digests):
+        for digest in digests:
+            self.add(digest)
+
+    def _spill(self):
+        run = tempfile.TemporaryFile()
+        run.write(b"".join(sorted(self.buffer)))
+        run.seek(0)
+        self.runs.append(run)
+        self.buffer = set()
+
+    def _read_run(self, run):
+        while True:
+            raw = run.read(self.digest_size)
+            if len(raw) < self.digest_size:
+                return
+            yield raw
+
+    def leaves(self):
+        # sorted raw digests without duplicates, hex order is byte order
+        last = None
+        for raw in heapq.merge(sorted(self.buffer), *[self._read_run(run) for run in self.runs]):
+            if raw != last:
+                yield raw
+            last = raw
+
+    def header(self, timestamp):
+        tokens = [str(timestamp)]
+        if len(self.last_proper_root) > 0 and self.last_root != self.last_proper_root:
+            tokens.append(self.last_proper_root)
+        if len(self.last_root) > 0:
+            tokens.append(self.last_root)
+        return " ".join(tokens)
+
+    def _build(self, timestamp, emit):
+        # emits the data line piece by piece, returns the block without the line itself
+        if timestamp is None:
+            timestamp = int(time.time())
+        header = self.header(timestamp)
+        emit(header + " " + _leaf_separator)
+        tree = merkle.MerkleBuilder(self.hashing)
+        for raw in self.leaves():
+            tree.add(raw)
+            emit(" " + raw.hex())
+        for run in self.runs:
+            run.close()
+        self.runs = []
+        self.buffer = set()
+        merkle_root = tree.root().hex()
+        algo = hashlib.new(merkle.base_hashing(self.hashing))
+        algo.update((header + " " + merkle_root).encode("utf-8"))
+        return {
+            "root": algo.hexdigest(),
+            "timestamp": timestamp,
+            "hashing": self.hashing,
+            "merkle_root": merkle_root,
+            "count": tree.count,
+        }
+
+    def write(self, out, timestamp=None):
+        # data line and `#root` line to the text file `out`, as the log has them
+        # (a `#hashing` line, if the algorithm changes, is up to the caller)
+        block = self._build(timestamp, out.write)
+        out.write("\n#root " + block["root"] + "\n")
+        return block
+
+    def finish(self, timestamp=None):
+        # like write, but the block keeps its data line and digests in memory
+        pieces = []
+        block = self._build(timestamp, pieces.append)
+        block["data"] = "".join(pieces)
+        block["hashed_files"] = [piece[1:] for piece in pieces[1:]]
+        return block
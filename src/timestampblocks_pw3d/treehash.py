@@ -0,0 +1,156 @@
+import os
+import hashlib
+import threading
+import merkle
+from concurrent.futures import ThreadPoolExecutor
+
+# chunked tree-hash digests, for trees dominated by a few huge files
+#
+# A hashing like "sha256-tree-4m" splits every file into 4 MiB chunks and
+# takes the RFC 6962 merkle root (see merkle.py) over them: leaf hash =
+# sha256(0x00 + chunk), so chunks can be hashed on all cores at once and a
+# single chunk can later be proven part of the file digest. Chunk sizes take
+# k, m or g as unit. The name goes into the log's `#hashing` header like any
+# other algorithm, an empty file digests to sha256(b"").
+# Concurrent chunks are read with one file object each, through a reusable
+# buffer per thread. The file is not mapped: a truncation by another process
+# would be SIGBUS for a mapping, a short read just raises OSError.
+
+_read_size = 1048576
+_buffers = threading.local()
+
+class TreeHasher:
+    # hashlib-like (update, digest, hexdigest) sequential variant, used when
+    # a file is read anyway, e.g. together with plain algorithms
+    name = None
+    algorithm = None
+    chunk_size = 0
+    builder = None
+    leaf = None #hasher of the current, incomplete chunk
+    filled = 0
+
+    def __init__(self, name):
+        self.name = name
+        (self.algorithm, self.chunk_size) = merkle.tree_mode(name)
+        self.builder = merkle.MerkleBuilder(self.algorithm)
+
+    def update(self, data):
+        with memoryview(data) as view:
+            offset = 0
+            while offset < len(view):
+                if self.leaf is None:
+                    self.leaf = hashlib.new(self.algorithm)
+                    self.leaf.update(b"\x00")
+                    self.filled = 0
+                take = min(self.chunk_size - self.filled, len(view) - offset)
+                with view[offset:offset+take] as part:
+                    self.leaf.update(part)
+                self.filled += take
+                offset += take
+                if self.filled == self.chunk_size:
+                    self.builder.add_leaf_hash(self.leaf.digest())
+                    self.leaf = None
+
+    def digest(self):
+        if self.leaf is None:
+            return self.builder.root()
+        builder = merkle.MerkleBuilder(self.algorithm)
+        builder.stack = list(self.builder.stack)
+        builder.count = self.builder.count
+        builder.add_leaf_hash(self.leaf.digest())
+        return builder.root()
+
+    def hexdigest(self):
+        return self.digest().hex()
+
+def new(hashing):
+    # hashlib.new with tree-hash modes
+    if merkle.tree_mode(hashing)[1] > 0:
+        return TreeHasher(hashing)
+    return hashlib.new(hashing)
+
+def is_tree(hashing):
+    return merkle.tree_mode(hashing)[1] > 0
+
+def common_chunk_size(hashings):
+    # chunk size if all hashings are tree modes with the same chunk size, else 0
+    sizes = {merkle.tree_mode(hashing)[1] for hashing in hashings}
+    if len(sizes) != 1:
+        return 0
+    return sizes.pop()
+
+def _buffer():
+    buf = getattr(_buffers, "buf", None)
+    if buf is None:
+        buf = bytearray(_read_size)
+        _buffers.buf = buf
+    return buf
+
+def _chunk_leaf_hashes(path, offset, length, algorithms):
+    leaves = [hashlib.new(algorithm) for algorithm in algorithms]
+    for leaf in leaves:
+        leaf.update(b"\x00")
+    with open(path, "rb", buffering=0) as f:
+        f.seek(offset)
+        with memoryview(_buffer()) as view:
+            while length > 0:
+                with view[:min(length, len(view))] as target:
+                    n = f.readinto(target)
+                if not n:
+                    raise OSError(path + " got shorter while it was hashed")
+                with view[:n] as part:
+                    for leaf in leaves:
+                        leaf.update(part)
+                length -= n
+    return [leaf.digest() for leaf in leaves]
+
+def chunk_leaf_hashes(path, hashings, jobs=None):
+    # list (per chunk) of lists (per hashing) of leaf hashes, chunks hashed concurrently
+    chunk_size = common_chunk_size(hashings)
+    if chunk_size == 0:
+        raise ValueError("no common chunk size in " + str(hashings))
+    algorithms = [merkle.tree_mode(hashing)[0] for hashing in hashings]
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+    offsets = range(0, size, chunk_size)
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as pool:
+        return list(pool.map(
+            lambda offset: _chunk_leaf_hashes(path, offset, min(chunk_size, size - offset), algorithms),
+            offsets
+        ))
+
+def parallel_digest(path, hashings, jobs=None):
+    # same digests as TreeHasher, hex str for one hashing, tuple for several
+    single = isinstance(hashings, str)
+    names = [hashings] if single else list(hashings)
+    builders = [merkle.MerkleBuilder(merkle.tree_mode(name)[0]) for name in names]
+    for hashes in chunk_leaf_hashes(path, names, jobs):
+        for (builder, node) in zip(builders, hashes):
+            builder.add_leaf_hash(node)
+    digests = [builder.root().hex() for builder in builders]
+    if single:
+        return digests[0]
+    return tuple(digests)
+
+def chunk_proof(path, hashing, offset, jobs=None):
+    # inclusion proof of the chunk holding byte `offset` in the file digest
+    (algorithm, chunk_size) = merkle.tree_mode(hashing)
+    nodes = [hashes[0] for hashes in chunk_leaf_hashes(path, [hashing], jobs)]
+    index = offset // chunk_size
+    if index >= len(nodes):
+        raise ValueError("offset " + str(offset) + " is beyond the end of " + path)
+    return {
+        "chunk": index,
+        "offset": index * chunk_size,
+        "length": min(chunk_size, os.path.getsize(path) - index * chunk_size),
+        "leaf": nodes[index].hex(),
+        "proof": merkle.proof_from_leaf_hashes(nodes, index, algorithm),
+    }
+
+def verify_chunk(proof, digest, hashing, chunk_data=None):
+    # True if the proven chunk leads to the file digest (and matches chunk_data, if given)
+    node = bytes.fromhex(proof["leaf"])
+    if chunk_data is not None and merkle.leaf_hash(hashing, bytes(chunk_data)) != node:
+        return False
+    return merkle.root_from_leaf_hash(node, proof["proof"], hashing).hex() == digest
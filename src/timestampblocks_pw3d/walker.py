@@ -0,0 +1,137 @@
+import os
+import time
+import pathspec
+import instrument
+
+# os.scandir based tree walker, ignore rules are checked before descending so
+# ignored subtrees are never visited
+#
+# Like git, every directory may carry its own ignore file whose patterns are
+# relative to that directory. The deepest file with a matching pattern
+# decides, within one file the last matching pattern decides, and nothing
+# below an ignored directory can be re-included. `.git` is never entered.
+
+_never_descend = (".git",)
+
+def _load_spec(path, extra_lines=()):
+    lines = list(extra_lines)
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            lines = f.read().splitlines() + lines
+    except OSError:
+        pass
+    if len(lines) == 0:
+        return None
+    return pathspec.PathSpec.from_lines("gitwildmatch", lines)
+
+def _decide(spec, relpath):
+    # True: ignored, False: explicitly re-included, None: no pattern matched
+    decision = None
+    for pattern in spec.patterns:
+        if pattern.include is not None and pattern.match_file(relpath) is not None:
+            decision = pattern.include
+    return decision
+
+def is_ignored(specs, relpath, is_dir=False):
+    # specs: list of (prefix, PathSpec) from the root down to the current directory
+    if is_dir:
+        relpath += "/"
+    for (prefix, spec) in reversed(specs):
+        decision = _decide(spec, relpath[len(prefix):])
+        if decision is not None:
+            return decision
+    return False
+
+def walk(root=".", ignorefile=".gitignore", extra_lines=(), dirs=False):
+    # yields (path, os.DirEntry) for every non-ignored non-directory entry
+    # `path` is relative to root, just like str() of a pathlib glob result
+    # `extra_lines` are additional patterns on the root level
+    # dirs=True also yields the visited directories, before their contents
+    specs = []
+    root_spec = _load_spec(os.path.join(root, ignorefile), extra_lines)
+    if root_spec is not None:
+        specs.append(("", root_spec))
+    yield from _walk_dir(root, "", "", ignorefile, specs, dirs)
+
+def _walk_dir(dirpath, path_prefix, rel_prefix, ignorefile, specs, dirs=False):
+    try:
+        with os.scandir(dirpath) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+    except OSError:
+        return
+    for entry in entries:
+        relpath = rel_prefix + entry.name
+        try:
+            is_dir = entry.is_dir(follow_symlinks=False)
+        except OSError:
+            is_dir = False
+        if is_dir and entry.name in _never_descend:
+            continue
+        if instrument.enabled:
+            started = time.perf_counter()
+            ignored = is_ignored(specs, relpath, is_dir)
+            instrument.count("ignore_match_s", time.perf_counter() - started)
+            instrument.count("dirs_visited" if is_dir else "entries_visited")
+            if ignored:
+                instrument.count("dirs_ignored" if is_dir else "entries_ignored")
+                continue
+        elif is_ignored(specs, relpath, is_dir):
+            continue
+        path = path_prefix + entry.name
+        if is_dir:
+            if dirs:
+                yield (path, entry)
+            sub_specs = specs
+            sub_spec = _load_spec(os.path.join(entry.path, ignorefile))
+            if sub_spec is not None:
+                sub_specs = specs + [(relpath + "/", sub_spec)]
+            yield from _walk_dir(entry.path, path + os.sep, relpath + "/", ignorefile, sub_specs, dirs)
+        else:
+            try:
+                if entry.is_dir():
+                    #symlinked directories are not followed
+                    continue
+            except OSError:
+                pass
+            yield (path, entry)
+
+class IgnoreRules:
+    # ignore decisions for single paths (e.g. from change events), the ignore
+    # files along the way are read once and kept until `clear`
+    root = None
+    ignorefile = None
+    extra_lines = None
+    specs = None #dict with key=relative directory, value=PathSpec or None
+
+    def __init__(self, root=".", ignorefile=".gitignore", extra_lines=()):
+        self.root = root
+        self.ignorefile = ignorefile
+        self.extra_lines = list(extra_lines)
+        self.specs = {}
+
+    def clear(self):
+        self.specs = {}
+
+    def _spec(self, reldir):
+        if reldir not in self.specs:
+            if reldir == "":
+                self.specs[reldir] = _load_spec(os.path.join(self.root, self.ignorefile), self.extra_lines)
+            else:
+                self.specs[reldir] = _load_spec(os.path.join(self.root, reldir, self.ignorefile))
+        return self.specs[reldir]
+
+    def ignored(self, relpath, is_dir=False):
+        # relpath with "/" separators; every ancestor directory is checked as well
+        parts = relpath.split("/")
+        specs = []
+        for i in range(len(parts)):
+            reldir = "/".join(parts[:i])
+            spec = self._spec(reldir)
+            if spec is not None:
+                specs.append((reldir + "/" if len(reldir) > 0 else "", spec))
+            part_is_dir = is_dir or i < len(parts) - 1
+            if part_is_dir and parts[i] in _never_descend:
+                return True
+            if is_ignored(specs, "/".join(parts[:i+1]), part_is_dir):
+                return True
+        return False
@@ -0,0 +1,167 @@
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import walker
+import digestcache
+
+# change sources for the `watch` command
+#
+# Both sources report relative paths ("/" separated) of touched files via
+# `poll(timeout)`, returning (set of paths, rescan). rescan=True means events
+# got lost and the caller should treat the whole tree as touched.
+# InotifySource needs Linux, PollingSource works everywhere but walks the
+# whole tree (stat only, no reading) on every poll.
+
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ISDIR = 0x40000000
+_watch_mask = (_IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+               | _IN_DELETE_SELF)
+_event_header = struct.Struct("iIII")
+
+class InotifySource:
+    libc = None
+    fd = -1
+    rules = None #walker.IgnoreRules
+    watches = None #dict with key=watch descriptor, value=relative directory ("" for root)
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.watches = {}
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.add_tree("")
+
+    def _add_watch(self, reldir):
+        path = os.path.join(self.rules.root, reldir) if len(reldir) > 0 else self.rules.root
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), _watch_mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                raise OSError(err, "inotify watch limit reached (fs.inotify.max_user_watches)")
+            return
+        self.watches[wd] = reldir
+
+    def add_tree(self, reldir):
+        # watches reldir and all non-ignored directories below, returns the files found there
+        files = set()
+        self._add_watch(reldir)
+        root = os.path.join(self.rules.root, reldir) if len(reldir) > 0 else self.rules.root
+        prefix = reldir + "/" if len(reldir) > 0 else ""
+        extra_lines = self.rules.extra_lines if len(reldir) == 0 else ()
+        for (path, entry) in walker.walk(root, self.rules.ignorefile, extra_lines, dirs=True):
+            relpath = prefix + path.replace(os.sep, "/")
+            if self.rules.ignored(relpath, entry.is_dir(follow_symlinks=False)):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                self._add_watch(relpath)
+            else:
+                files.add(relpath)
+        return files
+
+    def poll(self, timeout):
+        touched = set()
+        (readable, writable, failed) = select.select([self.fd], [], [], timeout)
+        if len(readable) == 0:
+            return touched, False
+        data = b""
+        while True:
+            try:
+                chunk = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            if len(chunk) == 0:
+                break
+            data += chunk
+        rescan = False
+        offset = 0
+        while offset + _event_header.size <= len(data):
+            (wd, mask, cookie, length) = _event_header.unpack_from(data, offset)
+            name = data[offset+_event_header.size:offset+_event_header.size+length].rstrip(b"\0")
+            offset += _event_header.size + length
+            if mask & _IN_Q_OVERFLOW:
+                rescan = True
+                continue
+            if mask & _IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            if wd not in self.watches or len(name) == 0:
+                continue
+            reldir = self.watches[wd]
+            relpath = (reldir + "/" if len(reldir) > 0 else "") + os.fsdecode(name)
+            if name.decode("utf-8", "replace") == self.rules.ignorefile:
+                # ignore rules changed, everything may look different now
+                self.rules.clear()
+                rescan = True
+                continue
+            if mask & _IN_ISDIR:
+                if mask & (_IN_CREATE | _IN_MOVED_TO) and not self.rules.ignored(relpath, True):
+                    touched.update(self.add_tree(relpath))
+                continue
+            if not self.rules.ignored(relpath):
+                touched.add(relpath)
+        return touched, rescan
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+class PollingSource:
+    rules = None
+    interval = 2.0
+    signatures = None #dict with key=relative path, value=(size, mtime_ns, inode)
+    scanned = 0.0 #time.monotonic() of the last scan
+
+    def __init__(self, rules, interval=2.0):
+        self.rules = rules
+        self.interval = interval
+        self.signatures = self._scan()
+        self.scanned = time.monotonic()
+
+    def _scan(self):
+        signatures = {}
+        for (path, entry) in walker.walk(self.rules.root, self.rules.ignorefile, self.rules.extra_lines):
+            st = digestcache.stat_entry(entry)
+            if st is not None:
+                signatures[path.replace(os.sep, "/")] = (st.st_size, st.st_mtime_ns, st.st_ino)
+        return signatures
+
+    def poll(self, timeout):
+        # the tree is scanned at most every `interval` seconds, shorter polls just wait
+        wait = self.scanned + self.interval - time.monotonic()
+        if wait > timeout:
+            time.sleep(max(0.0, timeout))
+            return set(), False
+        time.sleep(max(0.0, wait))
+        signatures = self._scan()
+        self.scanned = time.monotonic()
+        touched = {path for path in signatures if self.signatures.get(path) != signatures[path]}
+        self.signatures = signatures
+        return touched, False
+
+    def close(self):
+        pass
+
+def open_source(rules, poll_interval=2.0):
+    # inotify where possible, polling otherwise
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifySource(rules)
+        except (OSError, AttributeError) as e:
+            print("inotify not available (" + str(e) + "), falling back to polling")
+    return PollingSource(rules, poll_interval)
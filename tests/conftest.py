@@ -0,0 +1,6 @@
+import os
+import sys
+
+# the modules import each other by bare name, like when running capture.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "src", "timestampblocks_pw3d"))
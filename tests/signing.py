@@ -0,0 +1,24 @@
+import json
+import hashlib
+
+# stand-ins for the signing part of web3 (eth.account), shared by the EVM
+# tests: a signed transaction is the JSON of the transaction plus its
+# sender, its hash the sha256 of that JSON
+
+class SignedTransaction:
+    rawTransaction = None
+    hash = None
+
+    def __init__(self, tx):
+        self.rawTransaction = json.dumps(tx, sort_keys=True).encode("utf-8")
+        self.hash = hashlib.sha256(self.rawTransaction).digest()
+
+class Account:
+    address = "0xsender"
+
+    def sign_transaction(self, tx):
+        return SignedTransaction(dict(tx, sender=self.address))
+
+class AccountFactory:
+    def from_key(self, private_key):
+        return Account()
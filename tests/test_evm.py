@@ -0,0 +1,159 @@
+import json
+import hashlib
+import pytest
+import evm
+from signing import AccountFactory
+
+# evm.EvmPublisher against an in-process chain stand-in, passed in through
+# the `web3` hook: a web3-like object with an account factory, nonces, a
+# transaction pool and counters for every node request.
+
+class ChainEth:
+    account = None
+    chain = None
+
+    def __init__(self, chain):
+        self.account = AccountFactory()
+        self.chain = chain
+
+    def getTransactionCount(self, address, block_identifier):
+        self.chain.calls["getTransactionCount"] += 1
+        return self.chain.count(address)
+
+    @property
+    def gasPrice(self):
+        self.chain.calls["gasPrice"] += 1
+        return self.chain.gas_price
+
+    def estimateGas(self, tx):
+        self.chain.calls["estimateGas"] += 1
+        self.chain.estimated.append(tx)
+        return 21000
+
+    def sendRawTransaction(self, raw):
+        self.chain.calls["sendRawTransaction"] += 1
+        if len(self.chain.failures) > 0 and self.chain.failures[0] == "reject":
+            self.chain.failures.pop(0)
+            raise ValueError({"code": -32000, "message": "insufficient funds for gas * price + value"})
+        tx_hash = hashlib.sha256(raw).digest()
+        if tx_hash in self.chain.pool:
+            raise ValueError({"code": -32000, "message": "already known"})
+        tx = json.loads(raw.decode("utf-8"))
+        if tx["nonce"] != self.chain.count(tx["sender"]):
+            raise ValueError({"code": -32000, "message": "nonce too low"})
+        if len(self.chain.failures) > 0 and self.chain.failures[0] == "lost":
+            self.chain.failures.pop(0)
+            raise TimeoutError("request to the node timed out")
+        self.chain.pool[tx_hash] = tx
+        if len(self.chain.failures) > 0 and self.chain.failures[0] == "timeout":
+            # delivered, but the answer never comes back and the node stays unreachable for a moment
+            self.chain.failures.pop(0)
+            self.chain.unreachable = True
+            raise TimeoutError("read timed out")
+        self.chain.unreachable = False
+        return tx_hash
+
+    def getTransaction(self, tx_hash):
+        if self.chain.unreachable:
+            raise TimeoutError("read timed out")
+        return self.chain.pool.get(tx_hash)
+
+class Chain:
+    eth = None
+    pool = None #dict with key=transaction hash, value=transaction
+    calls = None
+    estimated = None
+    failures = None #list of "reject", "lost" or "timeout" for the next sends
+    gas_price = 1000
+    unreachable = False
+
+    def __init__(self):
+        self.eth = ChainEth(self)
+        self.pool = {}
+        self.calls = {"getTransactionCount": 0, "gasPrice": 0, "estimateGas": 0, "sendRawTransaction": 0}
+        self.estimated = []
+        self.failures = []
+
+    def count(self, address):
+        return len([tx for tx in self.pool.values() if tx["sender"] == address])
+
+    def toChecksumAddress(self, address):
+        return address
+
+class Clock:
+    now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+def root(i):
+    return hashlib.sha256(str(i).encode("utf-8")).hexdigest()
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(evm.time, "monotonic", clock.monotonic)
+    return clock
+
+def test_nonce_is_fetched_once_and_counted_locally(clock):
+    chain = Chain()
+    publisher = evm.EvmPublisher("http://node", "key", web3=chain)
+    for i in range(3):
+        publisher.publish(root(i))
+    assert sorted(tx["nonce"] for tx in chain.pool.values()) == [0, 1, 2]
+    assert chain.calls["getTransactionCount"] == 1
+
+def test_gas_price_is_cached_for_its_ttl(clock):
+    chain = Chain()
+    publisher = evm.EvmPublisher("http://node", "key", gas_price_ttl=30.0, web3=chain)
+    publisher.publish(root(0))
+    clock.now += 29.0
+    chain.gas_price = 2000
+    publisher.publish(root(1))
+    assert chain.calls["gasPrice"] == 1
+    clock.now += 2.0
+    publisher.publish(root(2))
+    assert chain.calls["gasPrice"] == 2
+    assert [tx["gasPrice"] for tx in sorted(chain.pool.values(), key=lambda tx: tx["nonce"])] == [1000, 1000, 2000]
+
+def test_gas_limit_is_estimated_with_margin(clock):
+    chain = Chain()
+    publisher = evm.EvmPublisher("http://node", "key", web3=chain)
+    publisher.publish(root(0))
+    (tx,) = chain.pool.values()
+    assert chain.estimated == [{"from": "0xsender", "to": "0x" + root(0)[:40], "value": 0}]
+    assert tx["gas"] == int(21000 * evm._gas_margin)
+    assert tx["to"] == "0x" + root(0)[:40]
+
+def test_retry_after_timeout_resends_the_same_transaction(clock):
+    chain = Chain()
+    publisher = evm.EvmPublisher("http://node", "key", web3=chain)
+    chain.failures = ["timeout"]
+    with pytest.raises(TimeoutError):
+        publisher.publish(root(0))
+    tx_hash = publisher.publish(root(0))
+    assert list(chain.pool) == [tx_hash]
+    assert chain.calls["sendRawTransaction"] == 2
+    assert chain.calls["estimateGas"] == 1
+
+def test_retry_after_lost_request_resends_the_same_transaction(clock):
+    chain = Chain()
+    publisher = evm.EvmPublisher("http://node", "key", web3=chain)
+    chain.failures = ["lost"]
+    with pytest.raises(TimeoutError):
+        publisher.publish(root(0))
+    tx_hash = publisher.publish(root(0))
+    assert list(chain.pool) == [tx_hash]
+    assert chain.calls["estimateGas"] == 1
+
+def test_rejected_transaction_is_signed_again_with_a_fresh_nonce(clock):
+    chain = Chain()
+    publisher = evm.EvmPublisher("http://node", "key", web3=chain)
+    publisher.publish(root(0))
+    chain.failures = ["reject"]
+    with pytest.raises(ValueError):
+        publisher.publish(root(1))
+    publisher.publish(root(1))
+    assert sorted(tx["nonce"] for tx in chain.pool.values()) == [0, 1]
+    assert chain.calls["getTransactionCount"] == 2
+    assert chain.calls["estimateGas"] == 3
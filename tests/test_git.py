@@ -0,0 +1,124 @@
+import os
+import sys
+import time
+import subprocess
+import pytest
+
+# the git channel (capture.publish_git and gitbackend.GitRepository) in a
+# work tree whose remote is a bare repository in tmp_path
+#
+# `update` runs as its own process in the work tree, like from the command
+# line, answers to its questions go in through stdin. Written files get an
+# mtime in the past, so that the digest cache trusts its entries for them.
+
+_capture = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        "src", "timestampblocks_pw3d", "capture.py")
+
+def git(cwd, *args):
+    return subprocess.run(["git"] + list(args), cwd=cwd, check=True, stdout=subprocess.PIPE,
+                          universal_newlines=True).stdout
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+    past = time.time() - 60
+    os.utime(path, (past, past))
+
+def update(work, channel, answers=None):
+    args = [sys.executable, _capture, "update", "-p", channel]
+    if answers is None:
+        args.append("-y")
+    result = subprocess.run(args, cwd=work, input=answers or "", stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            universal_newlines=True)
+    assert result.returncode == 0, result.stdout
+    return result.stdout
+
+def remote_files(repo):
+    return set(git(repo["remote"], "ls-tree", "-r", "--name-only", "main").split("\n")) - {""}
+
+def remote_text(repo, path):
+    return git(repo["remote"], "show", "main:" + path)
+
+@pytest.fixture
+def repo(tmp_path):
+    remote = str(tmp_path / "remote.git")
+    work = str(tmp_path / "work")
+    git(str(tmp_path), "init", "-q", "--bare", remote)
+    git(str(tmp_path), "init", "-q", work)
+    git(work, "config", "user.name", "test")
+    git(work, "config", "user.email", "test@localhost")
+    git(work, "remote", "add", "origin", remote)
+    write(os.path.join(work, ".timestampblocks", "config"),
+          "[default]\npublish = git\nhashing = sha256\nblocksize = auto\n\n[git]\nremote = origin\nbranch = main\n")
+    write(os.path.join(work, ".gitignore"), ".env\n")
+    write(os.path.join(work, "t.txt"), "first\n")
+    return {"work": work, "remote": remote}
+
+def test_commit_and_push(repo):
+    write(os.path.join(repo["work"], "sub", "b.txt"), "b\n")
+    update(repo["work"], "git")
+    assert {".gitignore", "t.txt", "sub/b.txt", "timestampblocks.log", ".timestampblocks/config"} <= remote_files(repo)
+    assert git(repo["work"], "rev-parse", "HEAD") == git(repo["remote"], "rev-parse", "main")
+    assert "timestampblocks update for root" in git(repo["remote"], "log", "-1", "--format=%s", "main")
+
+def test_nothing_to_commit(repo, monkeypatch, capsys):
+    update(repo["work"], "git")
+    head = git(repo["remote"], "rev-parse", "main")
+    monkeypatch.chdir(repo["work"])
+    import capture
+    assert capture.publish_git({"root": "00"}, True, False, "git", None) is None
+    assert "nothing to commit" in capsys.readouterr().out
+    assert git(repo["remote"], "rev-parse", "main") == head
+
+def test_deleted_files_are_removed(repo):
+    update(repo["work"], "git")
+    os.remove(os.path.join(repo["work"], "t.txt"))
+    write(os.path.join(repo["work"], "new.txt"), "new\n")
+    update(repo["work"], "git")
+    files = remote_files(repo)
+    assert "t.txt" not in files
+    assert "new.txt" in files
+
+def test_env_is_added_to_gitignore(repo):
+    os.remove(os.path.join(repo["work"], ".gitignore"))
+    write(os.path.join(repo["work"], ".env"), "SECRET=1\n")
+    output = update(repo["work"], "git")
+    assert ".env file is not excluded from git!" in output
+    with open(os.path.join(repo["work"], ".gitignore")) as f:
+        assert f.read() == ".env\n"
+    files = remote_files(repo)
+    assert ".gitignore" in files
+    assert ".env" not in files
+
+def test_info_exclude_is_honored(repo):
+    os.remove(os.path.join(repo["work"], ".gitignore"))
+    write(os.path.join(repo["work"], ".env"), "SECRET=1\n")
+    write(os.path.join(repo["work"], "local.txt"), "local\n")
+    with open(os.path.join(repo["work"], ".git", "info", "exclude"), "a") as f:
+        f.write(".env\nlocal.txt\n")
+    output = update(repo["work"], "git")
+    assert ".env file is not excluded from git!" not in output
+    files = remote_files(repo)
+    assert ".env" not in files
+    assert "local.txt" not in files
+    assert "t.txt" in files
+
+def test_change_from_a_run_without_git_is_committed(repo):
+    update(repo["work"], "git")
+    write(os.path.join(repo["work"], "t.txt"), "second\n")
+    update(repo["work"], "shell")
+    write(os.path.join(repo["work"], "new.txt"), "new\n")
+    update(repo["work"], "git")
+    assert remote_text(repo, "t.txt") == "second\n"
+    assert git(repo["work"], "status", "--porcelain", "t.txt") == ""
+
+def test_change_from_a_declined_run_is_committed(repo):
+    update(repo["work"], "git")
+    write(os.path.join(repo["work"], "t.txt"), "second\n")
+    assert "Aborting..." in update(repo["work"], "git", "n\n")
+    assert remote_text(repo, "t.txt") == "first\n"
+    write(os.path.join(repo["work"], "new.txt"), "new\n")
+    update(repo["work"], "git")
+    assert remote_text(repo, "t.txt") == "second\n"
+    assert git(repo["work"], "status", "--porcelain", "t.txt") == ""
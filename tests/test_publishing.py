@@ -0,0 +1,234 @@
+import sys
+import json
+import time
+import types
+import hashlib
+import threading
+import configparser
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from signing import AccountFactory
+
+# the concurrent publishing stage (capture._publish_channels) against local
+# http.server stand-ins for an IOTA node and an EVM JSON-RPC node
+#
+# The real publish_iota and publish_evm run, only their client libraries are
+# replaced by small urllib based clients talking to the stand-ins. Every
+# stand-in answers according to a plan per request kind: "ok", "error"
+# (HTTP 500) or "hang" (no answer for `hang_seconds`).
+
+_root = hashlib.sha256(b"block").hexdigest()
+_hang_seconds = 3.0
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])).decode("utf-8"))
+        kind = body.get("method", self.path)
+        self.server.requests.append((time.monotonic(), kind))
+        plan = self.server.plans.get(kind, [])
+        action = plan.pop(0) if len(plan) > 0 else "ok"
+        if action == "hang":
+            time.sleep(_hang_seconds)
+        if action == "error":
+            self.send_response(500)
+            self.end_headers()
+            return
+        answer = json.dumps(self.server.answer(body)).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(answer)))
+        self.end_headers()
+        self.wfile.write(answer)
+
+class StandIn(ThreadingHTTPServer):
+    daemon_threads = True
+    plans = None #dict with key=request kind, value=list of actions
+    requests = None #list of (time, request kind)
+
+    def __init__(self):
+        ThreadingHTTPServer.__init__(self, ("127.0.0.1", 0), StandInHandler)
+        self.plans = {}
+        self.requests = []
+
+    def url(self):
+        return "http://127.0.0.1:" + str(self.server_address[1])
+
+    def sent(self, kind):
+        return [at for (at, request_kind) in self.requests if request_kind == kind]
+
+class IotaStandIn(StandIn):
+    def answer(self, body):
+        return {"blockId": "0x" + hashlib.sha256(json.dumps(body).encode("utf-8")).hexdigest()}
+
+class EvmStandIn(StandIn):
+    def answer(self, body):
+        results = {
+            "eth_getTransactionCount": "0x0",
+            "eth_gasPrice": "0x3b9aca00",
+            "eth_estimateGas": "0x5208",
+            "eth_getTransactionByHash": None,
+        }
+        if body["method"] == "eth_sendRawTransaction":
+            result = "0x" + hashlib.sha256(bytes.fromhex(body["params"][0][2:])).hexdigest()
+        else:
+            result = results[body["method"]]
+        return {"jsonrpc": "2.0", "id": body["id"], "result": result}
+
+def post(url, body, timeout):
+    request = urllib.request.Request(url, json.dumps(body).encode("utf-8"), {"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read().decode("utf-8"))
+
+class IotaClient:
+    # the part of iota_client.IotaClient publish_iota uses
+    node = None
+
+    def __init__(self, options):
+        self.node = options["nodes"][0]
+
+    def build_and_post_block(self, secret_manager, options):
+        return post(self.node + "/api/core/v2/blocks", {"tag": options["tag"], "data": options["data"]}, None)["blockId"]
+
+class RpcEth:
+    # the part of web3.eth evm.EvmPublisher uses, as JSON-RPC over HTTP
+    account = None
+    uri = None
+    timeout = None
+    ids = 0
+
+    def __init__(self, uri, timeout):
+        self.account = AccountFactory()
+        self.uri = uri
+        self.timeout = timeout
+
+    def _call(self, method, params):
+        self.ids += 1
+        answer = post(self.uri, {"jsonrpc": "2.0", "id": self.ids, "method": method, "params": params}, self.timeout)
+        if "error" in answer:
+            raise ValueError(answer["error"])
+        return answer["result"]
+
+    def getTransactionCount(self, address, block_identifier):
+        return int(self._call("eth_getTransactionCount", [address, block_identifier]), 16)
+
+    @property
+    def gasPrice(self):
+        return int(self._call("eth_gasPrice", []), 16)
+
+    def estimateGas(self, tx):
+        return int(self._call("eth_estimateGas", [tx]), 16)
+
+    def sendRawTransaction(self, raw):
+        return bytes.fromhex(self._call("eth_sendRawTransaction", ["0x" + raw.hex()])[2:])
+
+    def getTransaction(self, tx_hash):
+        return self._call("eth_getTransactionByHash", ["0x" + tx_hash.hex()])
+
+class RpcWeb3:
+    eth = None
+
+    def __init__(self, uri, timeout):
+        self.eth = RpcEth(uri, timeout)
+
+    def toChecksumAddress(self, address):
+        return address
+
+@pytest.fixture
+def capture(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setitem(sys.modules, "iota_client", types.SimpleNamespace(IotaClient=IotaClient))
+    import capture
+    import evm
+    def get_publisher(node_uri, private_key, timeout=None, gas_price_ttl=evm._gas_price_ttl):
+        # no client timeout, the publishing stage has to enforce the channel timeout itself
+        return evm.EvmPublisher(node_uri, private_key, timeout, gas_price_ttl, web3=RpcWeb3(node_uri, None))
+    monkeypatch.setattr(evm, "get_publisher", get_publisher)
+    monkeypatch.setattr(capture, "_dotenv", {"INFURA_SECRET": "", "EVM_SECRET": "key"})
+    return capture
+
+@pytest.fixture
+def nodes():
+    servers = {"iota": IotaStandIn(), "evm": EvmStandIn()}
+    for server in servers.values():
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield servers
+    for server in servers.values():
+        server.shutdown()
+        server.server_close()
+
+def make_settings(nodes, **limits):
+    # limits: e.g. iota={"retries": "2"}
+    settings = configparser.ConfigParser()
+    settings["default"] = {"publish": "iota evm", "hashing": "sha256"}
+    settings["iota"] = {"protocol": "iota", "node": nodes["iota"].url(), "timeout": "5", "retries": "0",
+                        "backoff": "0.1"}
+    settings["evm"] = {"protocol": "evm", "node": nodes["evm"].url(), "api-key": "INFURA_SECRET",
+                       "private-key": "EVM_SECRET", "timeout": "5", "retries": "0", "backoff": "0.1"}
+    for channel in limits:
+        for key in limits[channel]:
+            settings[channel][key] = limits[channel][key]
+    return settings
+
+def publish_lines():
+    with open("timestampblocks.log") as f:
+        return {line.split()[1]: line.split() for line in f if line.startswith("#publish ")}
+
+def test_both_channels_publish_and_record_results(capture, nodes):
+    results = capture._publish_channels(["iota", "evm"], {"root": _root}, True, False, make_settings(nodes))
+    assert [(result["channel"], result["status"], result["attempts"]) for result in results] == [
+        ("iota", "ok", 1), ("evm", "ok", 1)]
+    lines = publish_lines()
+    assert lines["iota"][2:4] == ["ok", "1"]
+    assert lines["iota"][5] == results[0]["response"]
+    assert lines["evm"][2:4] == ["ok", "1"]
+    assert lines["evm"][5] == "0x" + results[1]["response"].hex()
+
+def test_failed_attempts_are_retried_with_backoff(capture, nodes):
+    nodes["iota"].plans["/api/core/v2/blocks"] = ["error", "error"]
+    settings = make_settings(nodes, iota={"retries": "2", "backoff": "0.2"})
+    (iota, evm) = capture._publish_channels(["iota", "evm"], {"root": _root}, True, False, settings)
+    assert (iota["status"], iota["attempts"], iota["error"]) == ("ok", 3, None)
+    sent = nodes["iota"].sent("/api/core/v2/blocks")
+    assert len(sent) == 3
+    assert sent[1] - sent[0] >= 0.2
+    assert sent[2] - sent[1] >= 0.4
+    assert evm["status"] == "ok"
+    assert publish_lines()["iota"][2:4] == ["ok", "3"]
+
+def test_channel_fails_after_its_retries(capture, nodes):
+    nodes["iota"].plans["/api/core/v2/blocks"] = ["error", "error", "error"]
+    settings = make_settings(nodes, iota={"retries": "1"})
+    (iota, evm) = capture._publish_channels(["iota", "evm"], {"root": _root}, True, False, settings)
+    assert (iota["status"], iota["attempts"]) == ("failed", 2)
+    assert "500" in iota["error"]
+    assert len(nodes["iota"].sent("/api/core/v2/blocks")) == 2
+    line = publish_lines()["iota"]
+    assert line[2:4] == ["failed", "2"]
+    assert "500" in line[5]
+
+def test_hanging_node_only_costs_its_own_timeout(capture, nodes):
+    nodes["evm"].plans["eth_sendRawTransaction"] = ["hang"]
+    settings = make_settings(nodes, evm={"timeout": "0.5"})
+    started = time.monotonic()
+    (iota, evm) = capture._publish_channels(["iota", "evm"], {"root": _root}, True, False, settings)
+    assert time.monotonic() - started < _hang_seconds
+    assert iota["status"] == "ok"
+    assert evm["status"] == "timeout"
+    line = publish_lines()["evm"]
+    assert line[2] == "timeout"
+    assert float(line[4]) >= 0.5
+
+def test_unknown_protocol_fails(capture, nodes, capsys):
+    settings = make_settings(nodes, iota={"protocol": "nope"})
+    (iota, evm) = capture._publish_channels(["iota", "evm"], {"root": _root, "scanned": ["a.txt"]}, True, False,
+                                            settings)
+    assert (iota["status"], iota["attempts"]) == ("failed", 1)
+    assert "protocol nope" in iota["error"]
+    assert len(nodes["iota"].sent("/api/core/v2/blocks")) == 0
+    assert evm["status"] == "ok"
+    assert "a.txt" not in capsys.readouterr().out
+    assert publish_lines()["iota"][2:4] == ["failed", "1"]